@@ -0,0 +1,82 @@
+from django.db.backends.mysql import base
+from django.db.backends.mysql.base import Database
+from django.utils.asyncio import async_unsafe
+
+from core.db.pool import ConnectionPool, PoolTimeout, get_pool
+
+# Defaults of the POOL dict of the database settings.
+POOL_DEFAULTS = {
+    # Connections this process may hold open at once.
+    "MAX_SIZE": 10,
+    # Seconds after which a connection is closed rather than reused; None keeps them.
+    "MAX_LIFETIME": 30 * 60,
+    # Seconds a request waits for a free connection before failing.
+    "TIMEOUT": 30,
+    # Connections idle for longer than this many seconds are pinged before reuse.
+    "CHECK_AFTER": 30,
+}
+
+
+def ping(connection):
+    connection.ping()
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The MySQL backend, taking connections from a pool shared by the threads
+    of the process instead of opening one for every request. Closing a
+    connection, which Django does when a request finishes, rolls it back
+    and returns it to the pool. CONN_MAX_AGE should stay 0 so connections
+    go back as soon as a request is over.
+    """
+
+    def get_pool(self, conn_params):
+        """The pool of connections made with `conn_params`, shared by every thread."""
+        options = {**POOL_DEFAULTS, **self.settings_dict.get("POOL", {})}
+
+        def connect():
+            connection = Database.connect(**conn_params)
+            # As in the parent backend, whose get_new_connection this replaces.
+            if connection.encoders.get(bytes) is bytes:
+                connection.encoders.pop(bytes)
+            return connection
+
+        def create():
+            return ConnectionPool(
+                connect,
+                max_size=options["MAX_SIZE"],
+                max_lifetime=options["MAX_LIFETIME"],
+                timeout=options["TIMEOUT"],
+                check=ping,
+                check_after=options["CHECK_AFTER"],
+            )
+
+        # Keyed by database too: the test runner switches the alias to the test database.
+        return get_pool(f"{self.alias}/{conn_params.get('db', '')}", create)
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        self._pool = self.get_pool(conn_params)
+        try:
+            return self._pool.acquire()
+        except PoolTimeout as e:
+            # Surfaces as a database error, which Django knows how to handle.
+            raise Database.OperationalError(str(e)) from e
+
+    def init_connection_state(self):
+        # Session settings survive in pooled connections; apply them once.
+        if not getattr(self.connection, "django_initialized", False):
+            super().init_connection_state()
+            self.connection.django_initialized = True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        discard = False
+        try:
+            # Never hand over a transaction left open, e.g. by a failed request.
+            self.connection.rollback()
+        except Database.Error:
+            discard = True
+        self._pool.release(self.connection, discard=discard)
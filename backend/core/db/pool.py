@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import deque
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """No connection of the pool became available in time."""
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of at most `max_size` DB-API connections opened by
+    `connect`. Idle connections are handed out most recently used first, so
+    the others can age out: those opened more than `max_lifetime` seconds ago
+    are closed instead of reused, and those idle for more than `check_after`
+    seconds must pass `check` first. Waits for a free connection give up
+    with PoolTimeout after `timeout` seconds.
+    """
+
+    def __init__(self, connect, max_size=10, max_lifetime=None, timeout=30, check=None, check_after=0):
+        self.connect = connect
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check = check
+        self.check_after = check_after
+        # (connection, opened at, released at) of the idle connections, most recent last.
+        self._idle = deque()
+        self._opened_at = {}
+        self._size = 0
+        self._condition = threading.Condition()
+        self._counters = dict.fromkeys(
+            ["opened", "reused", "closed", "failed_checks", "waits", "timeouts"], 0
+        )
+        self._wait_time = 0.0
+
+    def _count(self, name):
+        with self._condition:
+            self._counters[name] += 1
+
+    def _expired(self, opened_at, now):
+        return self.max_lifetime is not None and now - opened_at >= self.max_lifetime
+
+    def _discard(self, connection):
+        with self._condition:
+            self._opened_at.pop(id(connection), None)
+            self._size -= 1
+            self._counters["closed"] += 1
+            self._condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Return an idle connection still fit for use, or a new one while the pool has room."""
+        while True:
+            candidate = None
+            with self._condition:
+                started = None
+                while not self._idle and self._size >= self.max_size:
+                    if started is None:
+                        started = time.monotonic()
+                        self._counters["waits"] += 1
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        self._wait_time += time.monotonic() - started
+                        raise PoolTimeout(
+                            f"No database connection became available within {self.timeout} seconds."
+                        )
+                    self._condition.wait(remaining)
+                if started is not None:
+                    self._wait_time += time.monotonic() - started
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside of the lock.
+                    self._size += 1
+
+            if candidate is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._opened_at[id(connection)] = time.monotonic()
+                    self._counters["opened"] += 1
+                return connection
+
+            # Checks talk to the server, so they run outside of the lock too.
+            connection, opened_at, released_at = candidate
+            now = time.monotonic()
+            if self._expired(opened_at, now):
+                self._discard(connection)
+                continue
+            if self.check is not None and now - released_at >= self.check_after:
+                try:
+                    healthy = self.check(connection)
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    self._count("failed_checks")
+                    self._discard(connection)
+                    continue
+            self._count("reused")
+            return connection
+
+    def release(self, connection, discard=False):
+        """Give `connection` back, closing it instead when `discard` is set or it is too old."""
+        now = time.monotonic()
+        with self._condition:
+            opened_at = self._opened_at.get(id(connection), now)
+        if discard or self._expired(opened_at, now):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, opened_at, now))
+            self._condition.notify()
+
+    def close_idle(self):
+        """Close every idle connection, as when the process shuts down."""
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        """A snapshot of the size of the pool and of its counters since it was created."""
+        with self._condition:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._counters,
+                "wait_time": round(self._wait_time, 6),
+            }
+
+
+def get_pool(alias, create):
+    """The pool of the database `alias`, made by calling `create` on first use."""
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = create()
+        return _pools[alias]
+
+
+def pool_stats():
+    """The stats of the pool of each database alias used by this process so far."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
@@ -0,0 +1,124 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# The routing state of the request being served, set by ReplicaRoutingMiddleware.
+_state = ContextVar("replica_routing", default=None)
+
+
+# Carry the read-your-writes stickiness of a user from one request to the
+# next, whichever process serves it: a signed, expiring token of their id.
+STICKY_COOKIE = "replica_sticky"
+STICKY_HEADER = "X-Replica-Sticky"
+STICKY_SALT = "core.db.routers.sticky"
+
+
+class RoutingState:
+    def __init__(self, sticky_user_id=None):
+        # The replica the reads of the request go to, if any.
+        self.replica = None
+        self.wrote = False
+        # The user who wrote recently, according to the request.
+        self.sticky_user_id = sticky_user_id
+
+
+def sticky_token(user_id):
+    return signing.dumps(user_id, salt=STICKY_SALT)
+
+
+def sticky_user_id(request):
+    """The id of the user the request says wrote within DATABASE_REPLICA_STICKY_SECONDS, if any."""
+    token = request.headers.get(STICKY_HEADER) or request.COOKIES.get(STICKY_COOKIE)
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=STICKY_SALT, max_age=settings.DATABASE_REPLICA_STICKY_SECONDS)
+    except signing.BadSignature:
+        return None
+
+
+def read_from_replica(user):
+    """
+    Send the remaining reads of the current request to a replica, unless
+    there is none, `user` wrote recently or the request wrote already.
+    Returns the replica chosen, or None.
+    """
+    state = _state.get()
+    if state is None or state.wrote or not settings.DATABASE_REPLICAS:
+        return None
+    if user.is_authenticated and state.sticky_user_id == user.pk:
+        return None
+    state.replica = random.choice(settings.DATABASE_REPLICAS)
+    return state.replica
+
+
+class ReplicaRouter:
+    """
+    Routes the reads of requests that opted in with read_from_replica to
+    one of the DATABASE_REPLICAS, and everything else to the primary. A
+    write during the request moves its remaining reads back to the primary,
+    as do transactions, which must see their own changes.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+            state.replica = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Gives each request its own routing state. After a request in which a
+    user wrote, their next requests read from the primary for
+    DATABASE_REPLICA_STICKY_SECONDS, so they read their own writes: the
+    response carries a signed token, as a cookie and in the X-Replica-Sticky
+    header for clients that keep no cookies, which requests send back.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(sticky_user_id(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        # Set by DRF once the view authenticated the request.
+        user = getattr(request, "user", None)
+        if state.wrote and user is not None and user.is_authenticated:
+            sticky = sticky_token(user.pk)
+            response[STICKY_HEADER] = sticky
+            response.set_cookie(
+                STICKY_COOKIE,
+                sticky,
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "core.db.routers.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -96,15 +98,46 @@ if os.environ.get("IS_LOCAL") == "True":
 else:
     DATABASES = {
         "default": {
-            "ENGINE": "django.db.backends.mysql",
+            # The MySQL backend with a connection pool per process; see POOL.
+            "ENGINE": "core.db.backends.mysql",
             "NAME": os.environ["DATABASE_NAME"],
             "USER": os.environ["USER_NAME"],
             "PASSWORD": os.environ["USER_PASSWORD"],
             "HOST": os.environ["DATABASE_ADDRESS"],
             "PORT": os.environ["DATABASE_PORT"],
+            # Connections go back to the pool at the end of each request.
+            "CONN_MAX_AGE": 0,
+            "POOL": {
+                # Keep MAX_SIZE times the processes of every task under the
+                # max_connections of the database instance.
+                "MAX_SIZE": int(os.getenv("DATABASE_POOL_SIZE", 10)),
+                "MAX_LIFETIME": int(os.getenv("DATABASE_POOL_MAX_LIFETIME", 30 * 60)),
+                "TIMEOUT": int(os.getenv("DATABASE_POOL_TIMEOUT", 30)),
+                "CHECK_AFTER": int(os.getenv("DATABASE_POOL_CHECK_AFTER", 30)),
+            },
         }
     }
 
+# Read replicas of the primary, by address. The read-only actions of the
+# file manager read from one of them, unless the user wrote within the
+# last DATABASE_REPLICA_STICKY_SECONDS, which clients learn from the signed
+# token ReplicaRoutingMiddleware returns after writes; everything else uses
+# the primary.
+DATABASE_REPLICAS = []
+if os.environ.get("IS_LOCAL") != "True":
+    replica_addresses = os.getenv("DATABASE_REPLICA_ADDRESSES", "")
+    for index, address in enumerate(filter(None, replica_addresses.split(",")), 1):
+        alias = f"replica_{index}"
+        DATABASES[alias] = {
+            **DATABASES["default"],
+            "HOST": address.strip(),
+            "TEST": {"MIRROR": "default"},
+        }
+        DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["core.db.routers.ReplicaRouter"]
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -160,3 +193,86 @@ SPECTACULAR_SETTINGS = {
     "TITLE": "Django Drive Cloud",
     "DESCRIPTION": "Store and Share Files and Folders",
 }
+
+
+# File manager
+
+# Uploaded files are hashed while they are received to address their blob.
+FILE_UPLOAD_HANDLERS = [
+    "file_manager.uploadhandlers.HashingMemoryFileUploadHandler",
+    "file_manager.uploadhandlers.HashingTemporaryFileUploadHandler",
+]
+
+# Resumable uploads that received no chunk for this many seconds are removed
+# by the cleanup_upload_sessions management command.
+FILE_UPLOAD_SESSION_MAX_AGE = int(os.getenv("FILE_UPLOAD_SESSION_MAX_AGE", 24 * 60 * 60))
+
+# How downloads are transferred once access is checked: empty streams them
+# through Django, "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd)
+# hand them to the front proxy and "redirect" sends clients to a presigned
+# URL of the storage.
+FILE_DOWNLOAD_OFFLOAD = os.getenv("FILE_DOWNLOAD_OFFLOAD", "")
+
+# Internal nginx location aliased to MEDIA_ROOT, used with X-Accel-Redirect.
+FILE_DOWNLOAD_ACCEL_PREFIX = os.getenv("FILE_DOWNLOAD_ACCEL_PREFIX", "/protected/")
+
+# File content is kept in MEDIA_ROOT unless FILE_STORAGE_BUCKET names an
+# S3-compatible bucket, which every instance of the app can share. That needs
+# boto3 and django-storages; FILE_STORAGE_ENDPOINT_URL points them at a
+# stand-in such as MinIO.
+FILE_STORAGE_BUCKET = os.getenv("FILE_STORAGE_BUCKET", "")
+
+if FILE_STORAGE_BUCKET:
+    DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
+    AWS_STORAGE_BUCKET_NAME = FILE_STORAGE_BUCKET
+    AWS_S3_ENDPOINT_URL = os.getenv("FILE_STORAGE_ENDPOINT_URL") or None
+    AWS_S3_REGION_NAME = os.getenv("AWS_REGION") or None
+    AWS_S3_SIGNATURE_VERSION = "s3v4"
+    FILE_TRANSFER_BACKEND = "file_manager.transfers.s3.S3Transfers"
+else:
+    FILE_TRANSFER_BACKEND = "file_manager.transfers.local.LocalTransfers"
+
+# Lifetime in seconds of the presigned URLs of direct uploads and downloads.
+FILE_TRANSFER_URL_MAX_AGE = int(os.getenv("FILE_TRANSFER_URL_MAX_AGE", 15 * 60))
+
+# Bytes each user may store, unless their StorageUsage row sets a quota of
+# their own; 0 means unlimited.
+FILE_DEFAULT_QUOTA = int(os.getenv("FILE_DEFAULT_QUOTA", 0))
+
+# Compression at rest: "gzip" stores new content of text-like types
+# compressed when that saves at least a tenth of its size; empty stores
+# everything as uploaded. Direct uploads are always stored as uploaded.
+FILE_COMPRESSION = os.getenv("FILE_COMPRESSION", "")
+FILE_COMPRESSION_LEVEL = int(os.getenv("FILE_COMPRESSION_LEVEL", 6))
+
+# Seconds an orphaned blob, or stored content no blob points at, is kept
+# before the collect_garbage management command deletes it.
+FILE_GC_GRACE_PERIOD = int(os.getenv("FILE_GC_GRACE_PERIOD", 24 * 60 * 60))
+
+# Processes rendering file previews off the request path; 0 renders them
+# inline. Files larger than FILE_PREVIEW_MAX_SOURCE_SIZE bytes get none.
+FILE_PREVIEW_WORKERS = int(os.getenv("FILE_PREVIEW_WORKERS", 2))
+FILE_PREVIEW_MAX_SOURCE_SIZE = int(os.getenv("FILE_PREVIEW_MAX_SOURCE_SIZE", 50 * 1024 * 1024))
+
+# Rendered previews are kept by content hash in the "previews" cache, which
+# culls entries beyond FILE_PREVIEW_CACHE_MAX_ENTRIES. Point it at a shared
+# location (or another cache backend) when several hosts serve the app.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "previews": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv(
+            "FILE_PREVIEW_CACHE_LOCATION", os.path.join(tempfile.gettempdir(), "file_manager_previews")
+        ),
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("FILE_PREVIEW_CACHE_MAX_ENTRIES", 10000))},
+    },
+}
+
+# Most files accepted by one batch upload request; Django's own request
+# limits are raised to match, leaving room for their relative paths.
+FILE_BATCH_UPLOAD_MAX_FILES = int(os.getenv("FILE_BATCH_UPLOAD_MAX_FILES", 1000))
+DATA_UPLOAD_MAX_NUMBER_FILES = FILE_BATCH_UPLOAD_MAX_FILES
+DATA_UPLOAD_MAX_NUMBER_FIELDS = max(1000, FILE_BATCH_UPLOAD_MAX_FILES + 100)
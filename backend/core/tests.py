@@ -0,0 +1,186 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from core.db.pool import ConnectionPool, PoolTimeout
+from core.db.routers import (
+    STICKY_COOKIE,
+    STICKY_HEADER,
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+    read_from_replica,
+)
+
+User = get_user_model()
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(FakeConnection, max_size=2)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIs(pool.acquire(), connection)
+        stats = pool.stats()
+        self.assertEqual((stats["opened"], stats["reused"], stats["in_use"]), (1, 1, 1))
+
+    def test_a_full_pool_times_out(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.05)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        stats = pool.stats()
+        self.assertEqual((stats["size"], stats["waits"], stats["timeouts"]), (1, 1, 1))
+
+    def test_waiters_get_released_connections(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=5)
+        connection = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        time.sleep(0.05)
+        pool.release(connection)
+        waiter.join()
+        self.assertEqual(acquired, [connection])
+        self.assertEqual(pool.stats()["opened"], 1)
+
+    def test_old_connections_are_closed(self):
+        pool = ConnectionPool(FakeConnection, max_lifetime=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertEqual(pool.stats()["closed"], 1)
+
+    def test_unhealthy_connections_are_replaced(self):
+        pool = ConnectionPool(FakeConnection, check=lambda connection: False, check_after=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertTrue(connection.closed)
+        stats = pool.stats()
+        self.assertEqual((stats["failed_checks"], stats["size"]), (1, 1))
+
+    def test_failed_connects_free_their_slot(self):
+        def connect():
+            raise OSError("unreachable")
+
+        pool = ConnectionPool(connect, max_size=1, timeout=0)
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                pool.acquire()
+        self.assertEqual(pool.stats()["size"], 0)
+
+
+class DatabasePoolViewTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("db-pool")
+
+    def test_stats_are_for_admins_only(self):
+        self.client.force_authenticate(user=User.objects.create_user(username="user", password="password123"))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_superuser(username="admin", password="password123")
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response.data, dict)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRouterTests(SimpleTestCase):
+    # Outside of the transaction of TestCase, in which every read uses the primary.
+    databases = {"default"}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.user = User(pk=1, username="user")
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+
+    def serve(self, view):
+        """Run `view` as the middleware would, returning what it returned."""
+        result = []
+
+        def get_response(request):
+            result.append(view())
+            return HttpResponse()
+
+        self.response = ReplicaRoutingMiddleware(get_response)(self.request)
+        return result[0]
+
+    def route_read(self):
+        return self.router.db_for_read(User)
+
+    def test_reads_use_the_primary_unless_the_request_opts_in(self):
+        self.assertEqual(self.route_read(), "default")
+        self.assertEqual(self.serve(self.route_read), "default")
+
+        def read():
+            read_from_replica(self.user)
+            return self.route_read()
+
+        self.assertEqual(self.serve(read), "replica")
+
+    def test_writes_move_reads_back_to_the_primary(self):
+        def write_then_read():
+            read_from_replica(self.user)
+            self.assertEqual(self.router.db_for_write(User), "default")
+            return self.route_read()
+
+        self.assertEqual(self.serve(write_then_read), "default")
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.serve(lambda: self.router.db_for_write(User))
+        token = self.response[STICKY_HEADER]
+        self.assertEqual(self.response.cookies[STICKY_COOKIE].value, token)
+
+        def read():
+            return read_from_replica(self.request.user)
+
+        # Whichever process serves the next request, the token comes back.
+        self.assertEqual(self.serve(read), "replica")
+        self.request = RequestFactory().get("/", HTTP_X_REPLICA_STICKY=token)
+        self.request.user = self.user
+        self.assertIsNone(self.serve(read))
+        self.request = RequestFactory().get("/")
+        self.request.COOKIES[STICKY_COOKIE] = token
+        self.request.user = self.user
+        self.assertIsNone(self.serve(read))
+
+        # It only holds for the user who wrote, and only for a while.
+        self.request.user = User(pk=2, username="other")
+        self.assertEqual(self.serve(read), "replica")
+        self.request.user = AnonymousUser()
+        self.assertEqual(self.serve(read), "replica")
+        self.request.user = self.user
+        with override_settings(DATABASE_REPLICA_STICKY_SECONDS=-1):
+            self.assertEqual(self.serve(read), "replica")
+
+    def test_transactions_read_from_the_primary(self):
+        def read_in_transaction():
+            read_from_replica(self.user)
+            with transaction.atomic():
+                return self.route_read()
+
+        self.assertEqual(self.serve(read_in_transaction), "default")
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "file_manager"))
+        self.assertIsNone(self.router.allow_migrate("default", "file_manager"))
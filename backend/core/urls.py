@@ -6,6 +6,8 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from core.views import DatabasePoolView
+
 urlpatterns = [
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
     path("admin/", admin.site.urls),
@@ -17,4 +19,5 @@ urlpatterns = [
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("auth/", include("custom_auth.urls")),
     path("api/", include("file_manager.urls")),
+    path("api/db-pool/", DatabasePoolView.as_view(), name="db-pool"),
 ]
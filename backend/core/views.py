@@ -0,0 +1,21 @@
+from drf_spectacular.utils import extend_schema
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.db.pool import pool_stats
+
+
+class DatabasePoolView(APIView):
+    """
+    The database connection pools of the process serving the request: their
+    size, idle and in use connections, and counters of opened, reused and
+    closed connections, failed health checks, waits, timeouts and the total
+    seconds spent waiting.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(responses={200: {"type": "object", "additionalProperties": {"type": "object"}}})
+    def get(self, request):
+        return Response(pool_stats())
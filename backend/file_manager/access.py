@@ -0,0 +1,61 @@
+from .models import Folder, Share
+
+
+def get_share_targets(obj):
+    """
+    Return the (target_field, object_id) pairs whose shares apply to `obj`,
+    nearest first: the object itself, then its parent folder up to the root.
+    """
+    if isinstance(obj, Folder):
+        return [("folder", pk) for pk in reversed(obj.path_ids)]
+
+    targets = [("file", obj.id)]
+    if obj.folder_id:
+        targets += [("folder", pk) for pk in reversed(obj.folder.path_ids)]
+    return targets
+
+
+class AccessMap:
+    """
+    The shares received by a user, loaded in bulk once and resolved in memory.
+
+    A share on a folder applies to its whole subtree; a share on a descendant
+    overrides the inherited one, so the share on the nearest target wins.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._shares = None
+
+    @classmethod
+    def for_request(cls, request):
+        """Return the access map of the request user, shared by every permission check of the request."""
+        access_map = getattr(request, "_access_map", None)
+        if access_map is None or access_map.user != request.user:
+            access_map = cls(request.user)
+            request._access_map = access_map
+        return access_map
+
+    @property
+    def shares(self):
+        if self._shares is None:
+            self._shares = {}
+            for folder_id, file_id, permissions in Share.objects.filter(
+                shared_with=self.user
+            ).values_list("folder_id", "file_id", "permissions"):
+                target = ("folder", folder_id) if folder_id else ("file", file_id)
+                self._shares[target] = permissions
+        return self._shares
+
+    def resolve(self, obj):
+        """Return the permission mask `obj` inherits from its nearest share, or None."""
+        for target in get_share_targets(obj):
+            permissions = self.shares.get(target)
+            if permissions is not None:
+                return permissions
+        return None
+
+    def has_permission(self, obj, permission_field):
+        permissions = self.resolve(obj)
+        bit = Share.PERMISSION_BITS[permission_field]
+        return permissions is not None and bool(permissions & bit)
@@ -4,6 +4,3 @@ from django.apps import AppConfig
 class FileManagerConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "file_manager"
-
-    def ready(self):
-        import file_manager.signals
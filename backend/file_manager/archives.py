@@ -0,0 +1,136 @@
+import zipfile
+
+from django.utils import timezone
+
+from .models import File, Folder
+
+# Content is stored as is: deflating already compressed media costs CPU for nothing.
+COMPRESSION = zipfile.ZIP_STORED
+
+ITERATOR_CHUNK_SIZE = 500
+
+
+class StreamBuffer:
+    """
+    Write-only file object for zipfile. It is not seekable, so zipfile
+    writes data descriptors after each entry instead of seeking back, and
+    what it wrote so far is drained after every chunk.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def safe_name(name):
+    """An archive path component that cannot escape its directory when extracted."""
+    name = name.replace("/", "_").replace("\\", "_")
+    return "_" if name in ("", ".", "..") else name
+
+
+def zip_date_time(value):
+    # ZIP dates are local times and cannot predate 1980.
+    return max(timezone.localtime(value).timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def iter_folder_entries(root, can_read):
+    """
+    Yield the (arcname, file, modified) entries of a ZIP of the subtree of
+    `root`, where `file` is None for directories. Folders and files are only included when
+    `can_read(obj)` allows it, and every arcname is made unique.
+    """
+    folders = Folder.objects.filter(path__startswith=root.path).only(
+        "id", "name", "path", "owner", "updated_at"
+    )
+    names = {}
+    readable_folders = []
+    for folder in folders.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        names[folder.id] = safe_name(folder.name)
+        if can_read(folder):
+            readable_folders.append(folder)
+
+    depth = len(root.ancestor_ids)
+    directories = {}
+    for folder in readable_folders:
+        directories[folder.id] = "/".join(names[pk] for pk in folder.path_ids[depth:]) + "/"
+
+    used = set()
+
+    def unique(arcname):
+        if arcname in used:
+            stem, dot, extension = arcname.rpartition(".")
+            if not stem:
+                stem, dot, extension = arcname, "", ""
+            counter = 2
+            while f"{stem} ({counter}){dot}{extension}" in used:
+                counter += 1
+            arcname = f"{stem} ({counter}){dot}{extension}"
+        used.add(arcname)
+        return arcname
+
+    for folder in sorted(readable_folders, key=lambda folder: folder.path):
+        yield unique(directories[folder.id]), None, folder.updated_at
+
+    files = (
+        File.objects.filter(folder__path__startswith=root.path)
+        .select_related("blob", "folder")
+        .order_by("folder__path", "name")
+    )
+    for file in files.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        if not can_read(file):
+            continue
+        directory = directories.get(file.folder_id) or "/".join(
+            names[pk] for pk in file.folder.path_ids[depth:]
+        ) + "/"
+        yield unique(directory + safe_name(file.name)), file, file.updated_at
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    """
+    Generate a ZIP archive of `entries`, as yielded by iter_folder_entries,
+    piece by piece: memory use does not depend on the size of the files, and
+    ZIP64 records are used for large files and archives. Files whose content
+    cannot be read are left out.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=COMPRESSION, allowZip64=True) as archive:
+        for arcname, file, modified in entries:
+            info = zipfile.ZipInfo(arcname, date_time=zip_date_time(modified))
+            if file is None:
+                info.external_attr = 0o40755 << 16 | 0x10
+                archive.writestr(info, b"")
+                yield from drained(buffer)
+                continue
+
+            blob = file.blob
+            try:
+                content = blob.open_content()
+            except OSError:
+                continue
+            info.compress_type = COMPRESSION
+            info.external_attr = 0o100644 << 16
+            # The size is announced up front so zipfile picks ZIP64 when needed.
+            info.file_size = blob.size
+            with content, archive.open(info, mode="w") as entry:
+                for chunk in content.chunks(chunk_size):
+                    entry.write(chunk)
+                    yield from drained(buffer)
+            yield from drained(buffer)
+    yield from drained(buffer)
+
+
+def drained(buffer):
+    data = buffer.drain()
+    if data:
+        yield data
@@ -0,0 +1,133 @@
+import uuid
+
+from django.db import IntegrityError, transaction
+
+from .compression import compress, is_compressible
+from .models import Blob
+from .transfers import get_transfers
+
+
+def write_content(blob, content, filename):
+    """
+    Save the Django File `content` as the staged object of `blob`, gzipped
+    when `filename` names a compressible type and compression pays off.
+
+    The object is staged under a name of its own: writers of the same content
+    never share an object, and only the one whose row takes the hash moves
+    its object to the blob's name (see place_content).
+    """
+    storage = blob.file.storage
+    name = f"uploads/{uuid.uuid4()}.blob"
+    if is_compressible(filename, content.size):
+        compressed = compress(content)
+        if compressed is not None:
+            with compressed:
+                blob.encoding = "gzip"
+                blob.file.name = storage.save(name, compressed)
+            return
+    blob.file.name = storage.save(name, content)
+
+
+def place_content(blob, transfers):
+    """Move the staged object of `blob` to the name of its hash."""
+    name = blob.file.field.generate_filename(blob, blob.hash)
+    transfers.move(blob.file.name, name)
+    blob.file.name = name
+
+
+def store_blob(content, content_hash=None, filename=None):
+    """
+    Return the blob holding the content of the Django File `content`, writing
+    it to storage only when no blob has that hash yet. `filename`, by
+    default the name of `content`, decides whether it is compressed at rest.
+
+    The hash is taken from `content_hash`, then from the `sha256` attribute
+    set by the hashing upload handlers, and only computed as a last resort.
+    """
+    content_hash = (
+        content_hash or getattr(content, "sha256", None) or Blob.hash_content(content)
+    )
+    blob = Blob.objects.filter(hash=content_hash).first()
+    if blob is not None:
+        return blob
+
+    blob = Blob(hash=content_hash, size=content.size)
+    write_content(blob, content, filename or content.name or "")
+    staged = blob.file.name
+    try:
+        with transaction.atomic():
+            # The row is inserted first: a concurrent writer of the same
+            # content waits on it, then fails without touching the storage.
+            blob.file.name = blob.file.field.generate_filename(blob, content_hash)
+            blob.save()
+            get_transfers().move(staged, blob.file.name)
+    except IntegrityError:
+        # A concurrent upload stored the same content first.
+        blob.file.storage.delete(staged)
+        blob = Blob.objects.get(hash=content_hash)
+    return blob
+
+
+def store_uploaded_blob(transfers, key, content_hash, size):
+    """
+    Return the blob for content a client uploaded to `key` through
+    `transfers`, once verified: the object becomes the blob unless one
+    already holds that content, in which case the upload is discarded.
+    """
+    blob = Blob.objects.filter(hash=content_hash).first()
+    if blob is not None:
+        transfers.delete(key)
+        return blob
+
+    blob = Blob(hash=content_hash, size=size)
+    blob.file.name = blob.file.field.generate_filename(blob, content_hash)
+    try:
+        with transaction.atomic():
+            # Moved only once the row holds the hash, as in store_blob.
+            blob.save()
+            transfers.move(key, blob.file.name)
+    except IntegrityError:
+        # A concurrent upload stored the same content first.
+        transfers.delete(key)
+        blob = Blob.objects.get(hash=content_hash)
+    return blob
+
+
+def store_blobs(contents, filenames):
+    """
+    Return the blobs holding each Django File of `contents`, in order, with a
+    fixed number of queries: content already stored is found in one query
+    and the new blobs are inserted in bulk, then read back; the blobs whose
+    rows this call inserted get their staged content moved into place.
+    `filenames` are the names of the contents, as given to store_blob.
+    """
+    hashes = [
+        getattr(content, "sha256", None) or Blob.hash_content(content)
+        for content in contents
+    ]
+    blobs = Blob.objects.in_bulk(hashes, field_name="hash")
+
+    new_blobs = {}
+    for content, filename, content_hash in zip(contents, filenames, hashes):
+        if content_hash not in blobs and content_hash not in new_blobs:
+            blob = Blob(hash=content_hash, size=content.size)
+            write_content(blob, content, filename)
+            new_blobs[content_hash] = blob
+
+    if new_blobs:
+        transfers = get_transfers()
+        with transaction.atomic():
+            Blob.objects.bulk_create(new_blobs.values(), ignore_conflicts=True)
+            # Not every backend returns primary keys from bulk inserts.
+            stored = Blob.objects.in_bulk(list(new_blobs), field_name="hash")
+            placed = []
+            for content_hash, blob in new_blobs.items():
+                if stored[content_hash].file.name == blob.file.name:
+                    place_content(stored[content_hash], transfers)
+                    placed.append(stored[content_hash])
+                else:
+                    # A concurrent upload stored the same content first.
+                    blob.file.storage.delete(blob.file.name)
+            Blob.objects.bulk_update(placed, ["file"])
+        blobs.update(stored)
+    return [blobs[content_hash] for content_hash in hashes]
@@ -0,0 +1,81 @@
+import gzip
+import mimetypes
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+
+# Content types stored compressed when FILE_COMPRESSION is enabled. Media
+# and archive formats are compressed already and are left as they are.
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-ndjson",
+    "application/sql",
+    "application/x-yaml",
+    "image/svg+xml",
+)
+
+# Extensions the mimetypes module does not know but that hold text.
+COMPRESSIBLE_EXTENSIONS = (".log", ".jsonl", ".ndjson", ".yaml", ".yml", ".tsv", ".sql")
+
+# Content smaller than this gains too little from compression.
+MIN_SIZE = 1024
+
+# Compressed content is only kept when it is at most this fraction of the original.
+MAX_RATIO = 0.9
+
+SPOOL_SIZE = 1024 * 1024
+
+
+def is_compressible(filename, size):
+    """Whether content named `filename` of `size` bytes is worth compressing at rest."""
+    if settings.FILE_COMPRESSION != "gzip" or size < MIN_SIZE:
+        return False
+    if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        return True
+    content_type = mimetypes.guess_type(filename)[0] or ""
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(content):
+    """
+    Gzip the Django File `content` chunk by chunk into a temporary file and
+    return it as a Django File, or None when it would not shrink enough.
+    """
+    compressed = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    # A fixed mtime keeps the output identical for identical content.
+    with gzip.GzipFile(
+        fileobj=compressed, mode="wb", compresslevel=settings.FILE_COMPRESSION_LEVEL, mtime=0
+    ) as stream:
+        for chunk in content.chunks():
+            stream.write(chunk)
+    if compressed.tell() > content.size * MAX_RATIO:
+        compressed.close()
+        return None
+    compressed.seek(0)
+    return DjangoFile(compressed)
+
+
+class DecodedFile(DjangoFile):
+    """The decompressed content of a stored gzip object, of `size` bytes."""
+
+    def __init__(self, stored, size):
+        super().__init__(gzip.GzipFile(fileobj=stored, mode="rb"))
+        self.stored = stored
+        self.size = size
+
+    def close(self):
+        super().close()
+        self.stored.close()
+
+
+def open_stored(storage, name, encoding, size):
+    """Open the object `name` of `storage` for reading, decoding `encoding`."""
+    stored = storage.open(name, "rb")
+    if not encoding:
+        return stored
+    return DecodedFile(stored, size)
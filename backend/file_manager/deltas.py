@@ -0,0 +1,161 @@
+import hashlib
+import math
+import os
+import struct
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .blobs import store_blob
+from .models import Blob, File
+from .uploads import CHUNK_SIZE, PartFile
+
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+STRONG_DIGEST_SIZE = 16
+
+COPY = b"C"
+DATA = b"D"
+COPY_HEADER = struct.Struct(">QI")
+DATA_HEADER = struct.Struct(">I")
+
+
+class DeltaError(ValueError):
+    pass
+
+
+class DeltaConflict(Exception):
+    """The content changed while a delta against it was being applied."""
+
+
+def default_block_size(size):
+    """About the square root of `size`, as rsync picks it, in whole KiB."""
+    block_size = math.ceil(math.sqrt(size) / 1024) * 1024
+    return min(max(block_size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def read_exactly(stream, size):
+    """Read `size` bytes from `stream`, or fewer only at its end."""
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def iter_signature(blob, block_size):
+    """
+    Yield the signature of each `block_size` block of the content of `blob`,
+    the last one possibly shorter: its Adler-32, which clients roll over
+    their new version to find blocks it still has, and the first 16 bytes
+    of its SHA-256 in hex, which confirms a match.
+    """
+    with blob.open_content() as content:
+        while True:
+            block = read_exactly(content, block_size)
+            if not block:
+                return
+            strong = hashlib.sha256(block).digest()[:STRONG_DIGEST_SIZE]
+            yield zlib.adler32(block), strong.hex()
+
+
+def apply_delta(stream, blob, block_size, output):
+    """
+    Write to `output` the content the delta read from `stream` describes
+    against the content of `blob`, returning its (size, SHA-256). Raises
+    DeltaError for malformed deltas or blocks out of range.
+
+    A delta is a sequence of operations: b"C" followed by a big-endian
+    uint64 first block and uint32 block count copies that run of blocks of
+    the current content; b"D" followed by a big-endian uint32 length and
+    that many bytes is literal data.
+    """
+    block_count = math.ceil(blob.size / block_size)
+    digest = hashlib.sha256()
+    size = 0
+
+    def write(data):
+        nonlocal size
+        digest.update(data)
+        output.write(data)
+        size += len(data)
+
+    with blob.open_content() as basis:
+        while True:
+            operation = stream.read(1)
+            if not operation:
+                break
+            if operation == COPY:
+                header = read_exactly(stream, COPY_HEADER.size)
+                if len(header) < COPY_HEADER.size:
+                    raise DeltaError("The delta ends within a copy operation.")
+                first, count = COPY_HEADER.unpack(header)
+                if not count or first + count > block_count:
+                    raise DeltaError(f"Blocks {first} to {first + count - 1} do not exist.")
+                basis.seek(first * block_size)
+                remaining = min(count * block_size, blob.size - first * block_size)
+                while remaining:
+                    data = basis.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        raise DeltaError("The current content ended unexpectedly.")
+                    remaining -= len(data)
+                    write(data)
+            elif operation == DATA:
+                header = read_exactly(stream, DATA_HEADER.size)
+                if len(header) < DATA_HEADER.size:
+                    raise DeltaError("The delta ends within a data operation.")
+                (remaining,) = DATA_HEADER.unpack(header)
+                while remaining:
+                    data = stream.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        raise DeltaError("The delta ends within literal data.")
+                    remaining -= len(data)
+                    write(data)
+            else:
+                raise DeltaError(f"Unknown delta operation {operation!r}.")
+    return size, digest.hexdigest()
+
+
+def update_content(file, stream, block_size, expected_hash=None):
+    """
+    Replace the content of `file` with the result of the delta read from
+    `stream`, checked against `expected_hash` when given. The new content
+    is rebuilt in a temporary file, streaming from the current blob, and
+    stored as a blob of its own. Raises DeltaError for invalid deltas,
+    DeltaConflict when the file changed meanwhile and QuotaExceeded when
+    the new content does not fit the quota of the owner.
+    """
+    base = file.blob
+    output = tempfile.NamedTemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False)
+    try:
+        with output:
+            _, content_hash = apply_delta(stream, base, block_size, output)
+        if expected_hash and content_hash != expected_hash:
+            raise DeltaError("The rebuilt content does not match the declared SHA-256.")
+        # The file system storage moves the rebuilt content into place.
+        with PartFile(open(output.name, "rb")) as part:
+            blob = store_blob(part, content_hash, filename=file.name)
+    finally:
+        if os.path.exists(output.name):
+            os.remove(output.name)
+
+    if blob.pk == base.pk:
+        return file
+    with transaction.atomic():
+        now = timezone.now()
+        updated = File.objects.filter(pk=file.pk, blob=base).update(
+            blob=blob, size=blob.size, updated_at=now
+        )
+        if not updated:
+            raise DeltaConflict()
+        Blob.add_references({blob.pk: 1, base.pk: -1})
+        file.add_size(blob.size - base.size)
+    file.blob, file.size, file.updated_at = blob, blob.size, now
+    return file
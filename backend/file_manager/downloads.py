@@ -0,0 +1,284 @@
+import mimetypes
+import os
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+
+# Requests asking for more ranges than this get the whole file instead.
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class StorageStreamingResponse(StreamingHttpResponse):
+    """
+    A streaming response whose iterator only reads the storage, never the
+    database, so the ASGI handler of core.asgi may pull each chunk on any
+    worker thread instead of the single one the ORM needs.
+    """
+
+    thread_sensitive = False
+
+
+class StorageFileResponse(FileResponse):
+    """A FileResponse over a stored object, read in CHUNK_SIZE blocks on any worker thread."""
+
+    block_size = CHUNK_SIZE
+    thread_sensitive = False
+
+
+def parse_range_header(header, size):
+    """
+    Parse a `Range: bytes=...` header into the inclusive (start, end) pairs it
+    selects in a file of `size` bytes, sorted and with overlapping or adjacent
+    ranges merged.
+
+    Returns None when the header is absent or malformed, in which case the
+    whole file is served, and raises RangeNotSatisfiable when none of the
+    ranges overlaps the file.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    specs = header[len("bytes="):].split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, separator, last = spec.strip().partition("-")
+        if not separator or not (first.isdigit() or last.isdigit()):
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if end < start:
+                    return None
+            else:
+                # A suffix range: the last `last` bytes of the file.
+                length = int(last)
+                if not length:
+                    continue
+                start, end = max(size - length, 0), size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request, etag, last_modified):
+    """Whether the `If-Range` validator, if any, still matches the representation."""
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(("W/", '"')):
+        # If-Range requires the strong comparison, which a weak ETag never passes.
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def attachment_header(filename):
+    try:
+        filename.encode("ascii")
+        escaped = filename.replace("\\", "\\\\").replace('"', r"\"")
+        return f'attachment; filename="{escaped}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+def accepts_encoding(request, coding):
+    """Whether the Accept-Encoding header of `request` allows the content coding `coding`."""
+    accepted = {}
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+    return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+
+def stream_segments(blob, segments):
+    """
+    Yield the content of `blob` piece by piece: each segment is either
+    literal bytes or an inclusive (start, end) range of the content.
+    """
+    with blob.open_content() as content:
+        for segment in segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            start, end = segment
+            content.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                block = content.read(min(CHUNK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+
+def set_validators(response, etag, last_modified, vary_encoding=False):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    # Shares can be revoked at any time, so clients revalidate on every use.
+    response["Cache-Control"] = "private, no-cache"
+    if vary_encoding:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def offload_response(file, filename):
+    """
+    An empty response telling the front proxy to send the stored `file`
+    itself, according to the FILE_DOWNLOAD_OFFLOAD setting. The proxy then
+    takes care of Range requests.
+    """
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = HttpResponse(content_type=content_type)
+    response["Content-Disposition"] = attachment_header(filename)
+
+    mode = settings.FILE_DOWNLOAD_OFFLOAD
+    if mode == "x-accel-redirect":
+        response["X-Accel-Redirect"] = settings.FILE_DOWNLOAD_ACCEL_PREFIX + quote(
+            file.name
+        )
+    elif mode == "x-sendfile":
+        response["X-Sendfile"] = os.path.abspath(file.path)
+    else:
+        raise ImproperlyConfigured(
+            f"Unknown FILE_DOWNLOAD_OFFLOAD {mode!r}; expected "
+            "'x-accel-redirect', 'x-sendfile', 'redirect' or an empty value."
+        )
+    return response
+
+
+def file_response(request, blob, filename):
+    """
+    Serve the content of `blob` as an attachment named `filename`, honouring
+    conditional requests (If-None-Match, If-Modified-Since, If-Match,
+    If-Unmodified-Since) and byte ranges (Range, If-Range).
+
+    The blob hash is the strong ETag and, content being immutable, its
+    creation the last modification. Responses are 200, 206 with one range or
+    a multipart/byteranges body, 304, 412 or 416. When FILE_DOWNLOAD_OFFLOAD
+    names a front proxy, the transfer itself is handed to it once the
+    conditional headers are checked.
+
+    Content stored compressed is sent as is, with a Content-Encoding and its
+    own ETag, to clients accepting that encoding that ask for no range, and
+    decompressed on the fly otherwise; the proxy never serves it.
+    """
+    encoded = (
+        bool(blob.encoding)
+        and "HTTP_RANGE" not in request.META
+        and accepts_encoding(request, blob.encoding)
+    )
+    etag = quote_etag(f"{blob.hash}-{blob.encoding}" if encoded else blob.hash)
+    last_modified = int(blob.created_at.timestamp())
+    vary_encoding = bool(blob.encoding)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is not None:
+        return set_validators(response, etag, last_modified, vary_encoding)
+
+    if settings.FILE_DOWNLOAD_OFFLOAD not in ("", "redirect") and not blob.encoding:
+        return set_validators(offload_response(blob.file, filename), etag, last_modified)
+
+    if encoded:
+        response = StorageFileResponse(
+            blob.file.storage.open(blob.file.name, "rb"),
+            as_attachment=True,
+            filename=filename,
+        )
+        response["Content-Encoding"] = blob.encoding
+        return set_validators(response, etag, last_modified, vary_encoding)
+
+    size = blob.size
+    ranges = None
+    if request.method in ("GET", "HEAD") and if_range_matches(
+        request, etag, last_modified
+    ):
+        try:
+            ranges = parse_range_header(request.META.get("HTTP_RANGE"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return set_validators(response, etag, last_modified, vary_encoding)
+
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if ranges is None and not blob.encoding:
+        response = StorageFileResponse(
+            blob.file.storage.open(blob.file.name, "rb"),
+            as_attachment=True,
+            filename=filename,
+        )
+        return set_validators(response, etag, last_modified)
+    elif ranges is None:
+        response = StorageStreamingResponse(
+            stream_segments(blob, [(0, size - 1)]), content_type=content_type
+        )
+        response["Content-Length"] = size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StorageStreamingResponse(
+            stream_segments(blob, ranges), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = end - start + 1
+    else:
+        boundary = uuid.uuid4().hex
+        segments = []
+        for start, end in ranges:
+            segments.append(
+                (
+                    f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode()
+            )
+            segments.append((start, end))
+        segments.append(f"\r\n--{boundary}--\r\n".encode())
+
+        response = StorageStreamingResponse(
+            stream_segments(blob, segments),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+        )
+        response["Content-Length"] = sum(
+            len(segment) if isinstance(segment, bytes) else segment[1] - segment[0] + 1
+            for segment in segments
+        )
+
+    response["Content-Disposition"] = attachment_header(filename)
+    return set_validators(response, etag, last_modified, vary_encoding)
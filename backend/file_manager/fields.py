@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class PermissionMaskField(models.PositiveSmallIntegerField):
+    """Small integer holding a set of permission bits."""
+
+
+@PermissionMaskField.register_lookup
+class HasPermissions(models.Lookup):
+    """`permissions__has=mask` matches rows that have every bit of `mask` set."""
+
+    lookup_name = "has"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"({lhs} & {rhs}) = {rhs}", lhs_params + rhs_params + rhs_params
@@ -0,0 +1,158 @@
+import posixpath
+import uuid
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+
+from .models import Blob, File, UploadSession
+
+BATCH_SIZE = 500
+
+# Where file content lives in the storage: the blobs, the part files and
+# staged objects of upload sessions, plus the upload_to directories of File
+# from before blobs, whose content the blob migration adopted in place,
+# leaving the duplicates behind.
+STORAGE_PREFIXES = ("blobs", "uploads", "files", "documents")
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def iter_stored_names(storage, prefixes=STORAGE_PREFIXES):
+    """
+    Yield the name of every object stored under `prefixes`, listing one
+    directory at a time so memory use does not depend on the number of
+    objects.
+    """
+    for prefix in prefixes:
+        try:
+            directories, files = storage.listdir(prefix)
+        except FileNotFoundError:
+            continue
+        for name in files:
+            yield posixpath.join(prefix, name)
+        yield from iter_stored_names(
+            storage, [posixpath.join(prefix, directory) for directory in directories]
+        )
+
+
+def mark_orphans(now):
+    """
+    Stamp blobs that lost their last reference with `now`, and clear the
+    stamp of those referenced again. Returns the number of new orphans.
+    """
+    Blob.objects.filter(ref_count__gt=0, orphaned_at__isnull=False).update(orphaned_at=None)
+    return Blob.objects.filter(ref_count=0, orphaned_at__isnull=True).update(orphaned_at=now)
+
+
+def collect_blobs(cutoff, storage, batch_size=BATCH_SIZE):
+    """
+    Delete the blobs orphaned before `cutoff`, rows first and then their
+    content, one batch per transaction. Returns the number deleted.
+
+    Candidates are locked and checked again for files, so a blob reused
+    meanwhile is kept. Content that fails to delete is left to the storage
+    scan.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Blob.objects.select_for_update()
+                .filter(ref_count=0, orphaned_at__lt=cutoff)
+                .filter(~Exists(File.objects.filter(blob=OuterRef("pk"))))
+                .order_by("pk")
+                .values_list("pk", "file")[:batch_size]
+            )
+            Blob.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+        for _, name in batch:
+            try:
+                storage.delete(name)
+            except OSError:
+                pass
+        deleted += len(batch)
+        if len(batch) < batch_size:
+            return deleted
+
+
+def session_names(names):
+    """The names among `names` holding the content of an upload session that still exists."""
+    ids = {}
+    for name in names:
+        directory, filename = posixpath.split(name)
+        if directory != "uploads":
+            continue
+        try:
+            ids[name] = uuid.UUID(filename.split(".")[0])
+        except ValueError:
+            continue
+    existing = set(UploadSession.objects.filter(pk__in=set(ids.values())).values_list("pk", flat=True))
+    return {name for name, pk in ids.items() if pk in existing}
+
+
+def collect_stored_files(names, cutoff, storage, batch_size=BATCH_SIZE):
+    """
+    Delete the stored objects among `names` that no blob or upload session
+    points at and that were last modified before `cutoff`, looking names up one batch at a time.
+    Returns the (checked, deleted) counts.
+    """
+    checked = deleted = 0
+    for batch in batched(names, batch_size):
+        checked += len(batch)
+        referenced = set(Blob.objects.filter(file__in=batch).values_list("file", flat=True))
+        referenced.update(session_names(batch))
+        for name in batch:
+            if name in referenced:
+                continue
+            try:
+                # Recent objects may belong to a blob whose row is not saved yet.
+                if storage.get_modified_time(name) >= cutoff:
+                    continue
+                storage.delete(name)
+            except OSError:
+                continue
+            deleted += 1
+    return checked, deleted
+
+
+def recount_references(batch_size=BATCH_SIZE):
+    """
+    Set `ref_count` to the number of files pointing at each blob, fixing
+    counts left too high by deletes that bypass File.delete, such as the
+    cascade from a deleted user. Walks the blobs by primary key, one batch per
+    transaction, and yields whether each blob needed a fix.
+    """
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(
+                Blob.objects.select_for_update()
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "ref_count")[:batch_size]
+            )
+            counts = dict(
+                File.objects.filter(blob__in=[pk for pk, _ in blobs])
+                .order_by()
+                .values("blob")
+                .annotate(count=Count("pk"))
+                .values_list("blob", "count")
+            )
+            fixes = {}
+            for pk, ref_count in blobs:
+                if counts.get(pk, 0) != ref_count:
+                    fixes.setdefault(counts.get(pk, 0), []).append(pk)
+            for count, pks in fixes.items():
+                Blob.objects.filter(pk__in=pks).update(ref_count=count)
+        fixed = {pk for pks in fixes.values() for pk in pks}
+        for pk, _ in blobs:
+            yield pk in fixed
+        if len(blobs) < batch_size:
+            return
+        last_pk = blobs[-1][0]
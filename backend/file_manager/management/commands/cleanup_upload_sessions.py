@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from file_manager.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete upload sessions (and their part files) that have not received data for a while."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=settings.FILE_UPLOAD_SESSION_MAX_AGE,
+            help="Age in seconds after which an idle session is abandoned.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["max_age"])
+        abandoned = UploadSession.objects.filter(updated_at__lt=cutoff)
+        count = 0
+        for session in abandoned.iterator():
+            session.delete()
+            count += 1
+        self.stdout.write(f"Deleted {count} abandoned upload session(s).")
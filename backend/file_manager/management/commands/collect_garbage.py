@@ -0,0 +1,97 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from file_manager.garbage import (
+    BATCH_SIZE,
+    collect_blobs,
+    collect_stored_files,
+    iter_stored_names,
+    mark_orphans,
+    recount_references,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete blobs no file references anymore and stored content no blob points at, "
+        "once they have been unused for a grace period."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-period",
+            type=int,
+            default=settings.FILE_GC_GRACE_PERIOD,
+            help="Seconds an orphaned blob or stored object is kept before it is deleted.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Blobs or stored objects handled per query.",
+        )
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Also recount the references of every blob, fixing counts left by cascading deletes.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, collecting incrementally every --interval seconds.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=5 * 60,
+            help="Seconds between two rounds with --loop.",
+        )
+        parser.add_argument(
+            "--round-size",
+            type=int,
+            default=10000,
+            help="Stored objects scanned and blobs recounted per round with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        # With --loop, each round resumes the storage scan and the recount
+        # where the previous one stopped instead of starting over.
+        limit = options["round_size"] if options["loop"] else None
+        scan = recount = None
+        while True:
+            now = timezone.now()
+            cutoff = now - timedelta(seconds=options["grace_period"])
+
+            recounted = fixed = 0
+            if options["recount"]:
+                recount = recount or recount_references(batch_size)
+                for was_fixed in islice(recount, limit):
+                    recounted += 1
+                    fixed += was_fixed
+                if limit is None or recounted < limit:
+                    recount = None
+
+            mark_orphans(now)
+            blobs = collect_blobs(cutoff, default_storage, batch_size)
+
+            scan = scan or iter_stored_names(default_storage)
+            scanned, stored = collect_stored_files(
+                islice(scan, limit), cutoff, default_storage, batch_size
+            )
+            if limit is None or scanned < limit:
+                scan = None
+
+            message = f"Deleted {blobs} orphaned blob(s) and {stored} unreferenced stored object(s)"
+            if options["recount"]:
+                message += f", fixed {fixed} reference count(s)"
+            self.stdout.write(message + ".")
+
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
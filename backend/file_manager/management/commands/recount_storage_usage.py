@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from file_manager.models import File, Folder, StorageUsage
+from file_manager.usage import recompute_sizes
+
+
+class Command(BaseCommand):
+    help = "Recompute file sizes, folder sizes and the storage usage of every user from scratch."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            folders, users = recompute_sizes(File, Folder, StorageUsage)
+        self.stdout.write(f"Recomputed the size of {folders} folder(s) and the usage of {users} user(s).")
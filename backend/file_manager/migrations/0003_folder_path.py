@@ -0,0 +1,37 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:02
+
+from django.db import migrations, models
+
+
+def populate_folder_paths(apps, schema_editor):
+    Folder = apps.get_model('file_manager', 'Folder')
+    parents = dict(Folder.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def build_path(folder_id):
+        if folder_id not in paths:
+            parent_id = parents[folder_id]
+            parent_path = build_path(parent_id) if parent_id else '/'
+            paths[folder_id] = f'{parent_path}{folder_id}/'
+        return paths[folder_id]
+
+    folders = []
+    for folder_id in parents:
+        folders.append(Folder(id=folder_id, path=build_path(folder_id)))
+    Folder.objects.bulk_update(folders, ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_manager', '0002_auto_20240119_2133'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=768),
+        ),
+        migrations.RunPython(populate_folder_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+PERMISSION_FIELDS = ('can_read', 'can_edit', 'can_delete', 'can_share')
+NO_PERMISSIONS = (False,) * len(PERMISSION_FIELDS)
+
+
+def collapse_inherited_shares(apps, schema_editor):
+    """
+    Shares used to be copied onto every descendant of a shared folder, so a
+    descendant without a copy had been unshared. Shares are now inherited:
+    give such descendants an override without permissions, and delete each
+    share that only repeats the permissions of the share above it.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Folder = apps.get_model('file_manager', 'Folder')
+    File = apps.get_model('file_manager', 'File')
+    Share = apps.get_model('file_manager', 'Share')
+
+    folder_content_type = ContentType.objects.get_for_model(Folder)
+    file_content_type = ContentType.objects.get_for_model(File)
+    folder_ids = {}
+    for folder_id, path in Folder.objects.values_list('id', 'path'):
+        folder_ids[folder_id] = [int(pk) for pk in path.strip('/').split('/') if pk]
+
+    shares = {}
+    users_by_folder = {}
+    for share in Share.objects.values('id', 'content_type_id', 'object_id', 'shared_by_id', 'shared_with_id', *PERMISSION_FIELDS):
+        shares[(share['content_type_id'], share['object_id'], share['shared_with_id'])] = share
+        if share['content_type_id'] == folder_content_type.id:
+            users_by_folder.setdefault(share['object_id'], set()).add(share['shared_with_id'])
+
+    def permissions(content_type_id, object_id, user_id):
+        share = shares.get((content_type_id, object_id, user_id))
+        return tuple(share[field] for field in PERMISSION_FIELDS) if share else None
+
+    # Every folder and file with its parent folder and the folders above it, nearest first.
+    objects = [
+        (folder_content_type.id, folder_id, ids[-2::-1])
+        for folder_id, ids in folder_ids.items()
+    ] + [
+        (file_content_type.id, file_id, folder_ids.get(folder_id, [])[::-1])
+        for file_id, folder_id in File.objects.exclude(folder=None).values_list('id', 'folder_id')
+    ]
+
+    redundant_ids = []
+    overrides = []
+    for content_type_id, object_id, ancestor_ids in objects:
+        users = set().union(*(users_by_folder.get(pk, ()) for pk in ancestor_ids))
+        for user_id in users:
+            # Below a share, a parent without a share of its own had been unshared.
+            parent = permissions(folder_content_type.id, ancestor_ids[0], user_id) or NO_PERMISSIONS
+            own = permissions(content_type_id, object_id, user_id)
+            if own is None:
+                if parent != NO_PERMISSIONS:
+                    shared_by_id = next(
+                        shares[(folder_content_type.id, pk, user_id)]['shared_by_id']
+                        for pk in ancestor_ids
+                        if (folder_content_type.id, pk, user_id) in shares
+                    )
+                    overrides.append(Share(
+                        content_type_id=content_type_id,
+                        object_id=object_id,
+                        shared_by_id=shared_by_id,
+                        shared_with_id=user_id,
+                        **dict.fromkeys(PERMISSION_FIELDS, False),
+                    ))
+            elif own == parent:
+                redundant_ids.append(shares[(content_type_id, object_id, user_id)]['id'])
+
+    for start in range(0, len(redundant_ids), 1000):
+        Share.objects.filter(id__in=redundant_ids[start:start + 1000]).delete()
+    Share.objects.bulk_create(overrides, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('file_manager', '0003_folder_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_inherited_shares, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:06
+
+from functools import reduce
+from operator import add
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+import file_manager.fields
+
+BATCH_SIZE = 1000
+PERMISSION_BITS = {'can_read': 1, 'can_edit': 2, 'can_delete': 4, 'can_share': 8}
+
+
+def update_in_batches(Share, **values):
+    """Update every share in primary key ranges, committing each batch on its own."""
+    last_id = 0
+    while True:
+        ids = list(
+            Share.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+        with transaction.atomic():
+            Share.objects.filter(id__gte=ids[0], id__lte=ids[-1]).update(**values)
+        last_id = ids[-1]
+
+
+def booleans_to_mask(apps, schema_editor):
+    Share = apps.get_model('file_manager', 'Share')
+    mask = reduce(add, [
+        models.Case(models.When(**{field: True}, then=models.Value(bit)), default=models.Value(0))
+        for field, bit in PERMISSION_BITS.items()
+    ])
+    update_in_batches(Share, permissions=mask)
+
+
+def mask_to_booleans(apps, schema_editor):
+    Share = apps.get_model('file_manager', 'Share')
+    update_in_batches(Share, **{
+        field: models.Case(
+            models.When(permissions__has=bit, then=models.Value(True)),
+            default=models.Value(False),
+            output_field=models.BooleanField(),
+        )
+        for field, bit in PERMISSION_BITS.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    # Each batch of the conversion commits separately so the table is never locked as a whole.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('file_manager', '0004_collapse_inherited_shares'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='share',
+            name='permissions',
+            field=file_manager.fields.PermissionMaskField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='share',
+            index=models.Index(fields=['shared_with', 'content_type', 'object_id', 'permissions'], name='share_received_idx'),
+        ),
+        migrations.AlterField(
+            model_name='share',
+            name='shared_with',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shares_received', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(booleans_to_mask, mask_to_booleans),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:06
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_manager', '0005_share_permission_mask'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='share',
+            name='can_delete',
+        ),
+        migrations.RemoveField(
+            model_name='share',
+            name='can_edit',
+        ),
+        migrations.RemoveField(
+            model_name='share',
+            name='can_read',
+        ),
+        migrations.RemoveField(
+            model_name='share',
+            name='can_share',
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:13
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+TARGETS = ('file', 'folder')
+
+
+def update_in_batches(queryset, **values):
+    """Update `queryset` in primary key ranges, committing each batch on its own."""
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+        with transaction.atomic():
+            queryset.filter(id__gte=ids[0], id__lte=ids[-1]).update(**values)
+        last_id = ids[-1]
+
+
+def copy_generic_targets(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Share = apps.get_model('file_manager', 'Share')
+    for target in TARGETS:
+        model = apps.get_model('file_manager', target)
+        shares = Share.objects.filter(content_type=ContentType.objects.get_for_model(model))
+        # Shares of deleted objects were never cascaded by the generic relation.
+        shares.exclude(object_id__in=model.objects.values('id')).delete()
+        update_in_batches(shares, **{f'{target}_id': models.F('object_id')})
+    Share.objects.filter(file__isnull=True, folder__isnull=True).delete()
+
+
+def copy_typed_targets(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Share = apps.get_model('file_manager', 'Share')
+    for target in TARGETS:
+        model = apps.get_model('file_manager', target)
+        update_in_batches(
+            Share.objects.filter(**{f'{target}__isnull': False}),
+            content_type=ContentType.objects.get_for_model(model),
+            object_id=models.F(f'{target}_id'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    # Each batch of the copy commits separately so the table is never locked as a whole.
+    atomic = False
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('file_manager', '0006_remove_share_boolean_permissions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='share',
+            name='content_type',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AlterField(
+            model_name='share',
+            name='object_id',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='share',
+            name='file',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='file_manager.file'),
+        ),
+        migrations.AddField(
+            model_name='share',
+            name='folder',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='file_manager.folder'),
+        ),
+        migrations.AddIndex(
+            model_name='share',
+            index=models.Index(fields=['shared_with', 'folder', 'file', 'permissions'], name='share_received_target_idx'),
+        ),
+        migrations.RunPython(copy_generic_targets, copy_typed_targets),
+    ]
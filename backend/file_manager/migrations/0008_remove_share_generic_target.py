@@ -0,0 +1,33 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_manager', '0007_typed_share_targets'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='share',
+            unique_together={('folder', 'shared_with'), ('file', 'shared_with')},
+        ),
+        migrations.AddConstraint(
+            model_name='share',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('file__isnull', False), ('folder__isnull', True)), models.Q(('file__isnull', True), ('folder__isnull', False)), _connector='OR'), name='share_single_target'),
+        ),
+        migrations.RemoveIndex(
+            model_name='share',
+            name='share_received_idx',
+        ),
+        migrations.RemoveField(
+            model_name='share',
+            name='content_type',
+        ),
+        migrations.RemoveField(
+            model_name='share',
+            name='object_id',
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:25
+
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models, transaction
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+import file_manager.models
+
+BATCH_SIZE = 1000
+
+
+def hash_stored_file(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as content:
+        for chunk in content.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_blobs(apps, schema_editor):
+    """
+    Point every file at the blob of its content. The first stored copy of each
+    content becomes the blob in place; the duplicates stay on disk untouched
+    and are no longer referenced.
+    """
+    Blob = apps.get_model('file_manager', 'Blob')
+    File = apps.get_model('file_manager', 'File')
+
+    last_id = 0
+    while True:
+        files = list(File.objects.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not files:
+            break
+        with transaction.atomic():
+            for file in files:
+                try:
+                    content_hash = file.content_hash or hash_stored_file(file.file.name)
+                    size = default_storage.size(file.file.name)
+                except OSError:
+                    # Content that can no longer be read gets a blob of its own,
+                    # keyed by the file, so downloads keep answering 404.
+                    content_hash, size = f'missing-{file.id}', 0
+                blob, _ = Blob.objects.get_or_create(
+                    hash=content_hash, defaults={'size': size, 'file': file.file.name}
+                )
+                file.blob_id = blob.id
+            File.objects.bulk_update(files, ['blob'])
+        last_id = files[-1].id
+
+    Blob.objects.update(
+        ref_count=Coalesce(
+            models.Subquery(
+                File.objects.filter(blob=models.OuterRef('pk'))
+                .order_by()
+                .values('blob')
+                .annotate(count=models.Count('pk'))
+                .values('count')
+            ),
+            0,
+        )
+    )
+
+
+def unlink_blobs(apps, schema_editor):
+    Blob = apps.get_model('file_manager', 'Blob')
+    File = apps.get_model('file_manager', 'File')
+    blobs = Blob.objects.filter(pk=models.OuterRef('blob_id'))
+    File.objects.update(
+        file=models.Subquery(blobs.values('file')[:1]),
+        content_hash=models.Subquery(blobs.values('hash')[:1]),
+    )
+    File.objects.filter(content_hash__startswith='missing-').update(content_hash='')
+
+
+class Migration(migrations.Migration):
+
+    # Each batch of the linking commits separately so the table is never locked as a whole.
+    atomic = False
+
+    dependencies = [
+        ('file_manager', '0010_file_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('file', models.FileField(max_length=255, upload_to=file_manager.models.blob_upload_to)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='file_manager.blob'),
+        ),
+        migrations.RunPython(link_blobs, unlink_blobs),
+        migrations.AlterField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='files', to='file_manager.blob'),
+        ),
+        migrations.RemoveField(
+            model_name='file',
+            name='content_hash',
+        ),
+        # Gives the column a default so that unapplying can add it back.
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(default='', upload_to='files/'),
+        ),
+        migrations.RemoveField(
+            model_name='file',
+            name='file',
+        ),
+    ]
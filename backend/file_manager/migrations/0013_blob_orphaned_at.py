@@ -0,0 +1,18 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_manager', '0012_direct_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='orphaned_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
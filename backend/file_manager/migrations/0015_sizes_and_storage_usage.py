@@ -0,0 +1,45 @@
+# Generated by Django 3.2.23 on 2026-10-18 01:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from file_manager.usage import recompute_sizes
+
+
+def backfill_sizes(apps, schema_editor):
+    recompute_sizes(
+        apps.get_model('file_manager', 'File'),
+        apps.get_model('file_manager', 'Folder'),
+        apps.get_model('file_manager', 'StorageUsage'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('file_manager', '0014_blob_encoding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('used', models.PositiveBigIntegerField(default=0)),
+                ('quota', models.PositiveBigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_sizes, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
 from django.core.exceptions import ValidationError
+from django.db.models import Max, Value
+from django.db.models.functions import Concat, Length, Substr
 
 
 class UniqueNameMixin:
@@ -23,3 +25,100 @@ class UniqueNameMixin:
             raise ValidationError(
                 f"A {model.__name__.lower()} with the name '{self.name}' already exists in the same location for this user."
             )
+
+
+class MaterializedPathMixin:
+    """
+    Mixin to maintain a materialized path of ancestor ids (e.g. "/1/4/9/") on a
+    self-referencing model, so ancestor and subtree lookups are single indexed
+    queries instead of one query per level.
+    """
+
+    PATH_SEPARATOR = "/"
+    # Room kept for the id of an object that has not been saved yet.
+    PATH_ID_LENGTH = 20
+
+    @classmethod
+    def path_fits(cls, length):
+        """Whether a path of `length` characters fits the path column."""
+        return length <= cls._meta.get_field("path").max_length
+
+    @property
+    def path_ids(self):
+        """Ids from the root down to (and including) this object."""
+        return [int(pk) for pk in self.path.strip(self.PATH_SEPARATOR).split(self.PATH_SEPARATOR) if pk]
+
+    @property
+    def ancestor_ids(self):
+        """Ids of the ancestors of this object, from the root down to its parent."""
+        return self.path_ids[:-1]
+
+    def get_ancestors(self):
+        ancestors = self.__class__.objects.in_bulk(self.ancestor_ids)
+        return [ancestors[pk] for pk in self.ancestor_ids if pk in ancestors]
+
+    def get_descendants(self, include_self=False):
+        query = self.__class__.objects.filter(path__startswith=self.path)
+        if not include_self:
+            query = query.exclude(pk=self.pk)
+        return query
+
+    def prepare_path(self):
+        """
+        Compute the path this object must have after being saved, validating the
+        move if its parent changed and that the deepest path of its subtree still
+        fits the path column. Must run inside the transaction of the save. Returns the path currently stored in the
+        database, or None if the object has not been saved yet.
+        """
+        model = self.__class__
+        # Lock this object and its parent, in a fixed order, until the save
+        # commits: of two concurrent moves of one into the other, the second
+        # waits and then validates against the paths the first left.
+        paths = dict(
+            model.objects.select_for_update()
+            .filter(pk__in=[pk for pk in (self.pk, self.parent_id) if pk])
+            .order_by("pk")
+            .values_list("pk", "path")
+        )
+        stored_path = paths.get(self.pk) if self.pk else None
+
+        parent_path = self.PATH_SEPARATOR
+        if self.parent_id:
+            if self.parent_id not in paths:
+                raise model.DoesNotExist(f"{model.__name__} matching query does not exist.")
+            parent_path = paths[self.parent_id]
+            if stored_path and parent_path.startswith(stored_path):
+                raise ValidationError(
+                    f"A {model.__name__.lower()} cannot be moved inside itself or one of its descendants."
+                )
+
+        # Check the depth up front: some backends refuse overlong values with a database error.
+        new_path = f"{parent_path}{self.pk}{self.PATH_SEPARATOR}"
+        if not stored_path:
+            length = len(parent_path) + self.PATH_ID_LENGTH + 1
+        elif new_path != stored_path:
+            subtree = model.objects.filter(path__startswith=stored_path)
+            length = subtree.aggregate(longest=Max(Length("path")))["longest"] - len(stored_path) + len(new_path)
+        else:
+            length = 0
+        if not self.path_fits(length):
+            raise ValidationError(f"The {model.__name__.lower()} would be nested too deeply.")
+
+        # Never trust the in-memory path: an ancestor may have moved since this instance was loaded.
+        self.path = stored_path or ""
+        return stored_path, parent_path
+
+    def update_path(self, stored_path, parent_path):
+        """Persist the path of this object and, on a move, rewrite the paths of its whole subtree."""
+        new_path = f"{parent_path}{self.pk}{self.PATH_SEPARATOR}"
+        if new_path == stored_path:
+            return
+
+        model = self.__class__
+        if stored_path:
+            model.objects.filter(path__startswith=stored_path).update(
+                path=Concat(Value(new_path), Substr("path", len(stored_path) + 1))
+            )
+        else:
+            model.objects.filter(pk=self.pk).update(path=new_path)
+        self.path = new_path
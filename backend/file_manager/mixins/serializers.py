@@ -0,0 +1,24 @@
+class SparseFieldsetMixin:
+    """
+    Mixin to limit the fields returned on reads to the ones listed in the
+    `fields` query parameter, e.g. `?fields=id,name`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context)
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @staticmethod
+    def get_requested_fields(context):
+        """Return the set of requested field names, or None when every field is returned."""
+        request = context.get("request")
+        if request is None or request.method != "GET":
+            return None
+
+        requested = request.query_params.get("fields")
+        if not requested:
+            return None
+        return {name.strip() for name in requested.split(",")}
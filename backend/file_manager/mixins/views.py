@@ -1,19 +1,34 @@
-import os
+import io
+import json
 
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.http import FileResponse, Http404
-from django.shortcuts import get_object_or_404
-from file_manager.models import File, Share
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, OpenApiResponse, extend_schema
+from file_manager.access import AccessMap
+from file_manager.archives import iter_folder_entries, stream_zip
+from file_manager.deltas import (
+    MAX_BLOCK_SIZE,
+    MIN_BLOCK_SIZE,
+    DeltaConflict,
+    DeltaError,
+    default_block_size,
+    iter_signature,
+    update_content,
+)
+from file_manager.downloads import StorageStreamingResponse, attachment_header, file_response
+from file_manager.models import QuotaExceeded, Share
 from file_manager.permissions import CanEditParentFolder, CanShare, IsOwner
+from file_manager.previews import DEFAULT_PREVIEW_SIZE, PREVIEW_SIZES, UNAVAILABLE, get_preview
+from file_manager.sharing import share_objects, unshare_objects
+from file_manager.transfers import get_transfers
 from rest_framework import mixins, serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-User = get_user_model()
-
 
 class CustomCreateModelMixin(mixins.CreateModelMixin):
     def create(self, request, *args, **kwargs):
@@ -27,6 +42,8 @@ class CustomCreateModelMixin(mixins.CreateModelMixin):
             )
         except serializers.ValidationError as e:
             return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        except QuotaExceeded as e:
+            return Response({"detail": str(e)}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -47,22 +64,17 @@ class ShareModelMixin:
 
     def _process_sharing(self, request, obj, validated_data):
         current_user = request.user
-        usernames = validated_data["usernames"]
-        permissions = {
-            "can_read": validated_data["can_read"],
-            "can_edit": validated_data["can_edit"],
-            "can_delete": validated_data["can_delete"],
-            "can_share": validated_data["can_share"],
-        }
+        users = validated_data["users"]
+        permissions = Share.build_permissions(**validated_data)
 
-        if request.user.username in usernames:
+        if current_user in users:
             return Response(
                 {"error": "Cannot share with yourself"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         successful_shares, failed_shares = self._share_with_users(
-            obj, current_user, usernames, permissions
+            obj, current_user, users, permissions
         )
 
         return Response(
@@ -74,26 +86,10 @@ class ShareModelMixin:
             status=status.HTTP_200_OK,
         )
 
-    def _share_with_users(self, obj, shared_by, usernames, permissions):
-        successful_shares = []
-        failed_shares = []
-        content_type = ContentType.objects.get_for_model(obj)
-
-        for username in usernames:
-            try:
-                user_to_share_with = User.objects.get(username=username)
-                Share.objects.update_or_create(
-                    shared_by=shared_by,
-                    shared_with=user_to_share_with,
-                    content_type=content_type,
-                    object_id=obj.id,
-                    defaults=permissions,
-                )
-                successful_shares.append(username)
-            except User.DoesNotExist:
-                failed_shares.append(username)
-
-        return successful_shares, failed_shares
+    def _share_with_users(self, obj, shared_by, users, permissions):
+        # Usernames are resolved by the serializer, so only existing users get here.
+        share_objects([obj], users, shared_by, permissions)
+        return [user.username for user in users], []
 
 
 class UnshareModelMixin:
@@ -103,22 +99,19 @@ class UnshareModelMixin:
     )
     def unshare(self, request, pk=None):
         obj = self.get_object()
-        usernames = request.data.get("usernames")
-        for username in usernames:
-            user_to_unshare_with = get_object_or_404(User, username=username)
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            if obj.owner == user_to_unshare_with:
-                return Response(
-                    {"error": "Cannot unshare with the owner"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+        users = serializer.validated_data["users"]
+        usernames = serializer.validated_data["usernames"]
+        if any(user.id == obj.owner_id for user in users):
+            return Response(
+                {"error": "Cannot unshare with the owner"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-            content_type = ContentType.objects.get_for_model(obj)
-            Share.objects.filter(
-                shared_with=user_to_unshare_with,
-                content_type=content_type,
-                object_id=obj.id,
-            ).delete()
+        unshare_objects([obj], users, request.user)
 
         return Response(
             {"status": f"{obj} unshared from {usernames}"}, status=status.HTTP_200_OK
@@ -126,40 +119,253 @@ class UnshareModelMixin:
 
 
 class SharedWithMeMixin:
+    def get_shared_with_me_queryset(self):
+        """
+        Objects shared with the request user, joined to their shares. Supports
+        `?shared_by=<username>` and `?permission=read|edit|delete|share`.
+        """
+        query_params = self.request.query_params
+        permission = query_params.get("permission", "read")
+        bit = Share.PERMISSION_BITS.get(f"can_{permission}")
+        if bit is None:
+            raise serializers.ValidationError(
+                {"permission": f"Unknown permission level '{permission}'."}
+            )
+
+        filters = {
+            "shares__shared_with": self.request.user,
+            "shares__permissions__has": Share.READ | bit,
+        }
+        if "shared_by" in query_params:
+            filters["shares__shared_by__username"] = query_params["shared_by"]
+        return self.queryset.filter(**filters)
+
     @action(detail=False, methods=['get'], url_path='shared-with-me')
     def shared_with_me(self, request, *args, **kwargs):
-        model = self.queryset.model
-        model_content_type = ContentType.objects.get_for_model(model)
-        shared_objects_ids = Share.objects.filter(
-            shared_with=request.user, content_type=model_content_type, can_read=True
-        ).values_list("object_id", flat=True)
-
-        shared_objects = model.objects.filter(id__in=shared_objects_ids)
-        serializer = self.get_serializer(shared_objects, many=True)
-        return Response(serializer.data)
+        shared_objects = self.get_queryset()
+        page = self.paginate_queryset(shared_objects)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class PersonalMixin:
+    parent_field = "parent"  # Field holding the containing folder
+
+    def get_personal_queryset(self):
+        """
+        Objects owned by the request user. `?parent=<id>` limits them to the
+        content of one folder and `?parent=root` to the top level.
+        """
+        personal_models = self.queryset.filter(owner=self.request.user)
+        parent = self.request.query_params.get("parent")
+        if parent == "root":
+            personal_models = personal_models.filter(**{f"{self.parent_field}__isnull": True})
+        elif parent:
+            if not parent.isdigit():
+                raise serializers.ValidationError(
+                    {"parent": "Expected a folder id or 'root'."}
+                )
+            personal_models = personal_models.filter(**{self.parent_field: parent})
+        return personal_models
+
     @action(detail=False, methods=["get"], url_path="personal")
     def personal(self, request, *args, **kwargs):
-        model = self.queryset.model
-        personal_models = model.objects.filter(owner=request.user)
-        serializer = self.get_serializer(personal_models, many=True)
-        return Response(serializer.data)
+        personal_models = self.get_queryset()
+        page = self.paginate_queryset(personal_models)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class FileDownloadMixin:
     @action(detail=True, methods=["get"])
-    def download(self, pk):
-        try:
-            file_instance = self.get_queryset().get(pk=pk)
-        except File.DoesNotExist:
-            raise Http404("File does not exist")
+    def download(self, request, pk=None):
+        file_instance = self.get_object()
+        blob = file_instance.blob
+
+        # Content compressed at rest is decoded here rather than by the storage.
+        if settings.FILE_DOWNLOAD_OFFLOAD == "redirect" and not blob.encoding:
+            # The storage serves the content itself, conditional and range requests included.
+            return HttpResponseRedirect(
+                get_transfers().download_url(request, blob, file_instance.name)
+            )
 
-        file_path = os.path.join(settings.MEDIA_ROOT, file_instance.file.name)
-        if not os.path.exists(file_path):
+        if not blob.file.storage.exists(blob.file.name):
             raise Http404("File does not exist on the server")
+        return file_response(request, blob, file_instance.name)
+
+
+class FilePreviewMixin:
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("size", int, enum=PREVIEW_SIZES, description="Bounding box in pixels."),
+        ],
+        responses={
+            (200, "image/jpeg"): OpenApiTypes.BINARY,
+            (200, "image/png"): OpenApiTypes.BINARY,
+            202: OpenApiResponse(description="The preview is being rendered; retry later."),
+            304: OpenApiResponse(description="The cached preview is still current."),
+            404: OpenApiResponse(description="No preview can be rendered for this file."),
+        },
+    )
+    @action(detail=True, methods=["get"])
+    def preview(self, request, pk=None):
+        """A thumbnail of an image, or of the first page of a PDF."""
+        file_instance = self.get_object()
+        try:
+            size = int(request.query_params.get("size", DEFAULT_PREVIEW_SIZE))
+        except ValueError:
+            size = None
+        if size not in PREVIEW_SIZES:
+            raise serializers.ValidationError(
+                {"size": f"Expected one of {', '.join(map(str, PREVIEW_SIZES))}."}
+            )
+
+        blob = file_instance.blob
+        # Previews only depend on the content, which never changes for a blob.
+        etag = quote_etag(f"{blob.hash}-{size}")
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            preview = get_preview(blob, file_instance.name, size)
+            if preview is None:
+                return Response(
+                    {"detail": "The preview is being rendered."},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={"Retry-After": "1"},
+                )
+            if preview is UNAVAILABLE:
+                raise Http404("No preview is available for this file.")
+            content_type, data = preview
+            response = HttpResponse(data, content_type=content_type)
+        response["ETag"] = etag
+        # Shares can be revoked at any time, so clients revalidate on every use.
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class FileDeltaMixin:
+    """
+    Rsync-style content updates: clients fetch the `signature` of the
+    current content, match its blocks against their new version with a
+    rolling Adler-32, and send a `delta` copying the blocks they kept.
+    """
+
+    # Signature entries sent per chunk of the streamed response.
+    SIGNATURE_CHUNK = 1000
+
+    def get_block_size(self, request, blob):
+        try:
+            block_size = int(request.query_params.get("block_size") or default_block_size(blob.size))
+        except ValueError:
+            block_size = None
+        if block_size is None or not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            raise serializers.ValidationError(
+                {"block_size": f"Expected an integer between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}."}
+            )
+        return block_size
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("block_size", int, description="Block size in bytes; about the square root of the size by default."),
+        ],
+        responses={
+            (200, "application/json"): {
+                "type": "object",
+                "properties": {
+                    "block_size": {"type": "integer"},
+                    "size": {"type": "integer"},
+                    "sha256": {"type": "string"},
+                    "blocks": {
+                        "type": "array",
+                        "description": "[Adler-32, first 16 bytes of the SHA-256 in hex] of each block.",
+                        "items": {"type": "array", "items": {}},
+                    },
+                },
+            }
+        },
+    )
+    @action(detail=True, methods=["get"])
+    def signature(self, request, pk=None):
+        """The block checksums of the content, for computing a delta against it."""
+        blob = self.get_object().blob
+        block_size = self.get_block_size(request, blob)
+
+        def body():
+            # Streamed, as large files have many blocks and take a while to read.
+            header = json.dumps({"block_size": block_size, "size": blob.size, "sha256": blob.hash})
+            yield header[:-1].encode() + b', "blocks": ['
+            separator, entries = "", []
+            for weak, strong in iter_signature(blob, block_size):
+                entries.append(f'[{weak}, "{strong}"]')
+                if len(entries) == self.SIGNATURE_CHUNK:
+                    yield (separator + ", ".join(entries)).encode()
+                    separator, entries = ", ", []
+            if entries:
+                yield (separator + ", ".join(entries)).encode()
+            yield b"]}"
+
+        response = StorageStreamingResponse(body(), content_type="application/json")
+        response["ETag"] = quote_etag(blob.hash)
+        return response
+
+    @extend_schema(
+        operation_id="apply_delta",
+        parameters=[
+            OpenApiParameter("block_size", int, description="The block size of the signature used."),
+            OpenApiParameter("sha256", str, description="SHA-256 of the new content, checked once rebuilt."),
+            OpenApiParameter("If-Match", str, OpenApiParameter.HEADER, required=True, description="ETag of the signature used."),
+        ],
+        request={"application/octet-stream": {"type": "string", "format": "binary"}},
+    )
+    @action(detail=True, methods=["post"])
+    def delta(self, request, pk=None):
+        """
+        Replace the content with the result of a delta against the current
+        content, whose ETag `If-Match` must give. The delta is a sequence of
+        b"C" + big-endian uint64 first block + uint32 block count (copy
+        blocks) and b"D" + big-endian uint32 length + data (literal data).
+        """
+        file_instance = self.get_object()
+        blob = file_instance.blob
+        block_size = self.get_block_size(request, blob)
+        if_match = request.headers.get("If-Match")
+        if not if_match:
+            return Response(
+                {"detail": "Deltas need the ETag of the signature they were computed from in If-Match."},
+                status=status.HTTP_428_PRECONDITION_REQUIRED,
+            )
+        try:
+            if if_match != quote_etag(blob.hash):
+                raise DeltaConflict()
+            file_instance = update_content(
+                file_instance, request.stream or io.BytesIO(), block_size, request.query_params.get("sha256")
+            )
+        except DeltaError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DeltaConflict:
+            return Response(
+                {"detail": "The content changed since the signature was taken."},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+        except QuotaExceeded as e:
+            return Response({"detail": str(e)}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        response = Response(self.get_serializer(file_instance).data)
+        response["ETag"] = quote_etag(file_instance.blob.hash)
+        return response
+
+
+class FolderDownloadMixin:
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """Stream the folder and everything the user may read in it as a ZIP archive."""
+        folder = self.get_object()
+        access_map = AccessMap.for_request(request)
+
+        def can_read(obj):
+            return obj.owner_id == request.user.id or access_map.has_permission(obj, "can_read")
 
-        return FileResponse(
-            open(file_path, "rb"), as_attachment=True, filename=file_instance.name
+        response = StreamingHttpResponse(
+            stream_zip(iter_folder_entries(folder, can_read)),
+            content_type="application/zip",
         )
+        response["Content-Disposition"] = attachment_header(f"{folder.name}.zip")
+        return response
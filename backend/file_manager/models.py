@@ -1,71 +1,435 @@
+import hashlib
+import os
+import uuid
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.fields import GenericForeignKey
-from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.files.storage import default_storage
+from django.db import models, transaction
 
-from file_manager.mixins.models import UniqueNameMixin
+from file_manager.compression import open_stored
+from file_manager.fields import PermissionMaskField
+from file_manager.mixins.models import MaterializedPathMixin, UniqueNameMixin
 
 User = get_user_model()
 
 
-class Folder(models.Model, UniqueNameMixin):
+def updatable_fields(instance, *excluded):
+    """
+    Names of the loaded fields of `instance` other than `excluded`, for
+    saves that must not undo counters only ever changed in place, such as
+    the sizes, with the values of a stale instance.
+    """
+    deferred = instance.get_deferred_fields()
+    return [
+        field.name
+        for field in instance._meta.concrete_fields
+        if not field.primary_key and field.attname not in deferred and field.name not in excluded
+    ]
+
+
+class Folder(models.Model, UniqueNameMixin, MaterializedPathMixin):
     name = models.CharField(max_length=128)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     parent = models.ForeignKey(
         "self", on_delete=models.CASCADE, null=True, blank=True, related_name="children"
     )
+    # Ids of every ancestor plus this folder, e.g. "/1/4/9/"; maintained on create/move.
+    # 768 characters is the longest indexable utf8mb4 column on MySQL.
+    path = models.CharField(max_length=768, db_index=True, editable=False, default="")
+    # Total size of the files in this folder and its descendants, whoever owns them.
+    size = models.PositiveBigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, blank=True)
 
     def __str__(self):
-        if self.parent:
-            return f"{self.parent}::{self.name}"
-        return self.name
+        return "::".join([ancestor.name for ancestor in self.get_ancestors()] + [self.name])
 
     def save(self, *args, **kwargs):
         self.check_model_has_unique_name()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            stored_path, parent_path = self.prepare_path()
+            if not self._state.adding and "update_fields" not in kwargs:
+                kwargs["update_fields"] = updatable_fields(self, "size")
+            super().save(*args, **kwargs)
+            self.update_path(stored_path, parent_path)
+            if stored_path and stored_path != self.path:
+                # A move: the size leaves the old ancestors for the new ones.
+                size = Folder.objects.values_list("size", flat=True).get(pk=self.pk)
+                changes = dict.fromkeys(Folder(path=stored_path).ancestor_ids, -size)
+                for pk in self.ancestor_ids:
+                    changes[pk] = changes.get(pk, 0) + size
+                Folder.add_sizes(changes)
+
+    def delete(self, *args, **kwargs):
+        # Collect the whole subtree at once instead of cascading one level at a time.
+        subtree = self.get_descendants(include_self=True)
+        with transaction.atomic():
+            files = File.objects.filter(folder__in=subtree)
+            Blob.release(files)
+            StorageUsage.release(files)
+            stored = Folder.objects.filter(pk=self.pk).values_list("path", "size").first()
+            if stored:
+                path, size = stored
+                Folder.add_sizes(dict.fromkeys(Folder(path=path).ancestor_ids, -size))
+            # The cascade skips UploadSession.delete, which removes their content.
+            sessions = list(UploadSession.objects.filter(folder__in=subtree))
+            transaction.on_commit(lambda: [session.delete_content() for session in sessions])
+            return subtree.delete()
+
+    @classmethod
+    def add_sizes(cls, changes):
+        """Add each {folder_id: bytes} change of `changes`, negative ones shrinking, in one query."""
+        changes = {pk: change for pk, change in changes.items() if change}
+        if changes:
+            cls.objects.filter(pk__in=changes).update(
+                size=models.F("size")
+                + models.Case(
+                    *[models.When(pk=pk, then=models.Value(change)) for pk, change in changes.items()],
+                    output_field=models.BigIntegerField(),
+                )
+            )
+
+
+def permission_flag(bit):
+    """Boolean view over one bit of a `permissions` mask."""
+
+    def getter(self):
+        return bool(self.permissions & bit)
+
+    def setter(self, value):
+        if value:
+            self.permissions |= bit
+        else:
+            self.permissions &= ~bit
+
+    return property(getter, setter)
 
 
 class Share(models.Model):
+    READ = 1
+    EDIT = 2
+    DELETE = 4
+    SHARE = 8
+    PERMISSION_BITS = {
+        "can_read": READ,
+        "can_edit": EDIT,
+        "can_delete": DELETE,
+        "can_share": SHARE,
+    }
+
     shared_by = models.ForeignKey(
         User, related_name="shares_made", on_delete=models.CASCADE
     )
+    # Indexed through the leading column of share_received_idx.
     shared_with = models.ForeignKey(
-        User, related_name="shares_received", on_delete=models.CASCADE
+        User, related_name="shares_received", on_delete=models.CASCADE, db_index=False
+    )
+    # Exactly one of file/folder is set. Both are indexed through the leading
+    # column of their unique constraint.
+    file = models.ForeignKey(
+        "File",
+        related_name="shares",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    folder = models.ForeignKey(
+        Folder,
+        related_name="shares",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        db_index=False,
     )
-    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
-    object_id = models.PositiveIntegerField()
-    content_object = GenericForeignKey("content_type", "object_id")
 
-    can_read = models.BooleanField(default=True)
-    can_edit = models.BooleanField(default=False)
-    can_delete = models.BooleanField(default=False)
-    can_share = models.BooleanField(default=False)
+    permissions = PermissionMaskField(default=READ)
 
     class Meta:
-        unique_together = ("content_type", "object_id", "shared_with")
+        unique_together = [("file", "shared_with"), ("folder", "shared_with")]
+        constraints = [
+            models.CheckConstraint(
+                check=(
+                    models.Q(file__isnull=False, folder__isnull=True)
+                    | models.Q(file__isnull=True, folder__isnull=False)
+                ),
+                name="share_single_target",
+            ),
+        ]
+        indexes = [
+            # Covers the "shares received by a user" lookups (shared with me
+            # listings and access maps) without touching the table rows.
+            models.Index(
+                fields=["shared_with", "folder", "file", "permissions"],
+                name="share_received_target_idx",
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.user} -> {self.content_object}"
+        return f"{self.shared_with} -> {self.content_object}"
+
+    @property
+    def content_object(self):
+        return self.file if self.file_id else self.folder
+
+    @content_object.setter
+    def content_object(self, obj):
+        setattr(self, self.target_field(obj), obj)
+
+    @staticmethod
+    def target_field(obj):
+        """Name of the foreign key pointing at `obj`: "file" or "folder"."""
+        return "folder" if isinstance(obj, Folder) else "file"
+
+    @classmethod
+    def build_permissions(cls, **flags):
+        """Build a permission mask from `can_*` keyword flags."""
+        mask = 0
+        for field, bit in cls.PERMISSION_BITS.items():
+            if flags.get(field):
+                mask |= bit
+        return mask
+
+    can_read = permission_flag(READ)
+    can_edit = permission_flag(EDIT)
+    can_delete = permission_flag(DELETE)
+    can_share = permission_flag(SHARE)
+
+
+def blob_upload_to(instance, filename):
+    """Store blobs under their hash, fanned out over two directory levels: blobs/ab/cd/abcd..."""
+    return os.path.join("blobs", instance.hash[:2], instance.hash[2:4], instance.hash)
+
+
+class Blob(models.Model):
+    """
+    File content, stored once under its SHA-256 and shared by every File with
+    the same content. `ref_count` is the number of Files pointing at it; blobs
+    that drop to zero are left in place for the collect_garbage command,
+    which stamps `orphaned_at` and deletes them once a grace period passed.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField()
+    file = models.FileField(upload_to=blob_upload_to, max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+    # Content-Encoding of the stored object: "gzip" when compressed at rest, else empty.
+    encoding = models.CharField(max_length=16, blank=True, default="")
+    orphaned_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, blank=True)
+
+    def __str__(self):
+        return self.hash
+
+    def open_content(self):
+        """Open the content for reading, decompressed if it is stored compressed."""
+        return open_stored(self.file.storage, self.file.name, self.encoding, self.size)
+
+    @staticmethod
+    def hash_content(content):
+        """Return the SHA-256 hex digest of a Django File, read chunk by chunk."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def add_references(cls, counts):
+        """
+        Add the references of a {blob_id: count} mapping, negative counts
+        dropping them, with one query per distinct count. Referenced blobs are
+        no longer orphans.
+        """
+        blob_ids_by_count = {}
+        for blob_id, count in counts.items():
+            blob_ids_by_count.setdefault(count, []).append(blob_id)
+        for count, blob_ids in blob_ids_by_count.items():
+            changes = {"ref_count": models.F("ref_count") + count}
+            if count > 0:
+                changes["orphaned_at"] = None
+            cls.objects.filter(pk__in=blob_ids).update(**changes)
+
+    @classmethod
+    def release(cls, files):
+        """Drop the references the `files` queryset holds, before deleting it."""
+        counts = files.order_by().values("blob").annotate(count=models.Count("pk"))
+        cls.add_references(
+            {blob_id: -count for blob_id, count in counts.values_list("blob", "count")}
+        )
 
 
 class File(models.Model, UniqueNameMixin):
     name = models.CharField(max_length=128)
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True)
-    file = models.FileField(upload_to='files/')
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="files")
     owner = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="owned_files"
     )
+    # Size of the content, copied from the blob so usage adds up without joins.
+    size = models.PositiveBigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, blank=True)
 
     def __str__(self):
         return f"{self.name}"
 
+    @property
+    def file(self):
+        return self.blob.file
+
+    @property
+    def content_hash(self):
+        """SHA-256 of the content, used as the strong ETag of downloads."""
+        return self.blob.hash
+
     def save(self, *args, **kwargs):
-        if not self.name:
-            self.name = self.file.name
         self.check_model_has_unique_name()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            adding = self._state.adding
+            if adding:
+                self.size = self.blob.size
+                self.add_size(self.size)
+            elif "update_fields" not in kwargs:
+                kwargs["update_fields"] = updatable_fields(self, "size")
+            super().save(*args, **kwargs)
+            if adding:
+                Blob.add_references({self.blob_id: 1})
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            if deleted[0]:
+                Blob.objects.filter(pk=self.blob_id).update(ref_count=models.F("ref_count") - 1)
+                self.add_size(-self.size)
+            return deleted
+
+    def add_size(self, change):
+        """
+        Count `change` more bytes for the owner and every folder containing
+        this file; raises QuotaExceeded, before anything changed, when that
+        takes the owner over their quota.
+        """
+        StorageUsage.charge(self.owner_id, change)
+        if self.folder_id:
+            folder = Folder.objects.only("path").get(pk=self.folder_id)
+            Folder.add_sizes(dict.fromkeys(folder.path_ids, change))
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: chunks are written at their offset into a part file
+    until finalized. A direct session is instead uploaded by the client
+    straight to the storage, under `staging_key`, with a presigned request.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True)
+    name = models.CharField(max_length=128)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    direct = models.BooleanField(default=False)
+    # Hex digest declared by the client, required for direct uploads and
+    # optional for chunked ones; checked on finalize.
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.offset}/{self.size})"
+
+    @property
+    def staging_key(self):
+        return f"uploads/{self.id}"
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.MEDIA_ROOT, "uploads", f"{self.id}.part")
+
+    def delete_content(self):
+        """Remove the part file or the staged object of the session."""
+        if self.direct:
+            default_storage.delete(self.staging_key)
+        elif os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def delete(self, *args, **kwargs):
+        self.delete_content()
+        return super().delete(*args, **kwargs)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class StorageUsage(models.Model):
+    """
+    The bytes taken by the files a user owns, kept up to date as files come
+    and go so usage and quota checks are a single row lookup. A null `quota`
+    falls back to FILE_DEFAULT_QUOTA, where 0 means unlimited.
+    """
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="storage_usage"
+    )
+    used = models.PositiveBigIntegerField(default=0)
+    quota = models.PositiveBigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user} uses {self.used} of {self.limit or 'unlimited'} bytes"
+
+    @property
+    def limit(self):
+        """The quota that applies, or None when there is none."""
+        if self.quota is not None:
+            return self.quota
+        return settings.FILE_DEFAULT_QUOTA or None
+
+    @property
+    def available(self):
+        return None if self.limit is None else max(self.limit - self.used, 0)
+
+    @classmethod
+    def check_quota(cls, user_id, size):
+        """Raise QuotaExceeded when `size` more bytes would not fit the quota of the user."""
+        usage = cls.objects.filter(user_id=user_id).first() or cls(user_id=user_id)
+        if usage.limit is not None and usage.used + size > usage.limit:
+            raise QuotaExceeded(
+                f"Storing {size} more bytes would exceed the storage quota: {usage.available} bytes are available."
+            )
+
+    @classmethod
+    def charge(cls, user_id, size):
+        """
+        Add `size` bytes to the usage of the user in a single conditional
+        update, which concurrent uploads cannot both slip through, or raise
+        QuotaExceeded without changing it. Negative sizes always succeed.
+        """
+        if not size:
+            return
+        if size < 0:
+            cls.objects.filter(user_id=user_id).update(used=models.F("used") + size)
+            return
+        fits = models.Q(quota__isnull=False, quota__gte=models.F("used") + size)
+        if settings.FILE_DEFAULT_QUOTA:
+            fits |= models.Q(quota__isnull=True, used__lte=settings.FILE_DEFAULT_QUOTA - size)
+        else:
+            fits |= models.Q(quota__isnull=True)
+        for _ in range(2):
+            if cls.objects.filter(fits, user_id=user_id).update(used=models.F("used") + size):
+                return
+            _, created = cls.objects.get_or_create(user_id=user_id)
+            if not created:
+                break
+        cls.check_quota(user_id, size)
+        raise QuotaExceeded("The storage quota would be exceeded.")
+
+    @classmethod
+    def release(cls, files):
+        """Take the sizes of the `files` queryset off their owners' usage, before deleting it."""
+        totals = files.order_by().values("owner").annotate(total=models.Sum("size"))
+        for user_id, total in totals.values_list("owner", "total"):
+            cls.charge(user_id, -total)
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DriveCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key: each page is an indexed range scan
+    that starts where the previous one ended, whatever the page number.
+    """
+
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = "-id"
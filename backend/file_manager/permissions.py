@@ -1,6 +1,7 @@
 from rest_framework.permissions import IsAuthenticated
 
-from .models import ContentType, File, Folder, Share
+from .access import AccessMap
+from .models import Folder
 
 
 class BaseAccessPermission(IsAuthenticated):
@@ -8,26 +9,19 @@ class BaseAccessPermission(IsAuthenticated):
 
     permission_field = None  # To be defined in subclasses
 
-    def _get_content_type(self, obj):
-        return ContentType.objects.get_for_model(type(obj))
-
     def has_object_permission(self, request, view, obj):
-        if obj.owner == request.user:
+        if obj.owner_id == request.user.id:
             return True  # Owner always has permission
 
-        content_type = self._get_content_type(obj)
-        return self.check_shared_permission(request, obj, content_type)
+        return self.check_shared_permission(request, obj)
 
-    def check_shared_permission(self, request, obj, content_type):
-        if not content_type or not self.permission_field:
+    def check_shared_permission(self, request, obj):
+        if not self.permission_field:
             return False
 
-        return Share.objects.filter(
-            content_type=content_type,
-            object_id=obj.id,
-            shared_with=request.user,
-            **{self.permission_field: True}
-        ).exists()
+        # Shares are inherited from ancestor folders, so resolve the effective one.
+        access_map = AccessMap.for_request(request)
+        return access_map.has_permission(obj, self.permission_field)
 
 
 class IsOwner(IsAuthenticated):
@@ -36,7 +30,7 @@ class IsOwner(IsAuthenticated):
     message = "You must be the owner of this object to access it."
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        return obj.owner_id == request.user.id
 
 
 class CanRead(BaseAccessPermission):
@@ -68,25 +62,27 @@ class CanDelete(BaseAccessPermission):
 
 
 class CanEditParentFolder(IsAuthenticated):
-    """Check if the user can create a folder in the specified location."""
+    """Check if the user can create an object in the folder given by the request."""
+
+    message = "You do not have permission to create an object in this location."
 
-    message = "You do not have permission to create a folder in this location."
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
 
-    def has_object_permission(self, request, view):
-        parent_id = request.data.get("parent")
+        parent_id = request.data.get(getattr(view, "parent_field", "parent"))
         if not parent_id:  # Allow creation at root level
             return True
 
-        parent_folder = Folder.objects.filter(pk=parent_id).first()
+        try:
+            parent_folder = Folder.objects.filter(pk=int(parent_id)).first()
+        except (TypeError, ValueError):
+            return True  # Not an id: left to the serializer to reject
         if not parent_folder:
             return False
 
-        return (
-            parent_folder.owner == request.user
-            or Share.objects.filter(
-                shared_with=request.user,
-                content_type=ContentType.objects.get_for_model(Folder),
-                object_id=parent_id,
-                can_edit=True,
-            ).exists()
-        )
+        if parent_folder.owner_id == request.user.id:
+            return True
+
+        access_map = AccessMap.for_request(request)
+        return access_map.has_permission(parent_folder, "can_edit")
@@ -0,0 +1,138 @@
+import io
+import mimetypes
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .compression import open_stored
+
+try:
+    import fitz  # PyMuPDF, for the first page of PDFs.
+except ImportError:
+    fitz = None
+
+# Bounding boxes, in pixels, previews can be requested at.
+PREVIEW_SIZES = (128, 256, 512, 1024)
+DEFAULT_PREVIEW_SIZE = 256
+
+# Seconds a preview stays claimed by the worker rendering it; after that,
+# another request may submit it again.
+PENDING_TIMEOUT = 60
+
+# Cached in place of a preview that cannot be rendered, so it is not tried again.
+UNAVAILABLE = False
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class PreviewUnavailable(Exception):
+    pass
+
+
+def preview_kind(filename):
+    """Return "image" or "pdf" when a preview can be rendered for `filename`, else None."""
+    content_type = mimetypes.guess_type(filename)[0] or ""
+    if content_type.startswith("image/") and content_type != "image/svg+xml":
+        return "image"
+    if content_type == "application/pdf" and fitz is not None:
+        return "pdf"
+    return None
+
+
+def render_preview(name, encoding, content_size, kind, size):
+    """
+    Render the stored object `name` as an image fitting in a `size` pixels
+    square, returning its (content type, bytes). Runs in the worker
+    processes; raises PreviewUnavailable for content that cannot be decoded.
+    """
+    try:
+        with open_stored(default_storage, name, encoding, content_size) as content:
+            if kind == "pdf":
+                with fitz.open(stream=content.read(), filetype="pdf") as document:
+                    page = document.load_page(0)
+                    zoom = size / max(page.rect.width, page.rect.height)
+                    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                    image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+            else:
+                image = Image.open(content)
+                # Lets JPEG decode at a reduced scale instead of full resolution.
+                image.draft("RGB", (size, size))
+                image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size), Image.LANCZOS)
+    except (OSError, ValueError, RuntimeError, Image.DecompressionBombError) as error:
+        raise PreviewUnavailable(str(error)) from error
+
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image.save(output, format="PNG", optimize=True)
+        return "image/png", output.getvalue()
+    image.convert("RGB").save(output, format="JPEG", quality=80, optimize=True)
+    return "image/jpeg", output.getvalue()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Workers set Django up to use the storage when they are spawned
+            # rather than forked.
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.FILE_PREVIEW_WORKERS, initializer=django.setup
+            )
+        return _executor
+
+
+def _store(key, future):
+    cache = caches["previews"]
+    try:
+        cache.set(key, future.result())
+    except PreviewUnavailable:
+        cache.set(key, UNAVAILABLE)
+    except Exception:
+        # The worker died; leave the preview to be submitted again.
+        pass
+    cache.delete(f"{key}:pending")
+
+
+def get_preview(blob, filename, size):
+    """
+    Return the (content type, bytes) preview of `blob` for a file named
+    `filename`, UNAVAILABLE when there cannot be one, or None while it is
+    being rendered.
+
+    Previews are cached by content hash in the size-bounded "previews" cache.
+    Missing ones are rendered by a pool of FILE_PREVIEW_WORKERS processes,
+    off the request path, or inline when that setting is 0.
+    """
+    kind = preview_kind(filename)
+    if kind is None or blob.size > settings.FILE_PREVIEW_MAX_SOURCE_SIZE:
+        return UNAVAILABLE
+
+    cache = caches["previews"]
+    key = f"preview:{kind}:{blob.hash}:{size}"
+    preview = cache.get(key)
+    if preview is not None:
+        return preview
+
+    if not settings.FILE_PREVIEW_WORKERS:
+        try:
+            preview = render_preview(blob.file.name, blob.encoding, blob.size, kind, size)
+        except PreviewUnavailable:
+            preview = UNAVAILABLE
+        cache.set(key, preview)
+        return preview
+
+    # Only the first request submits the preview, whichever process serves it.
+    if cache.add(f"{key}:pending", True, timeout=PENDING_TIMEOUT):
+        future = get_executor().submit(
+            render_preview, blob.file.name, blob.encoding, blob.size, kind, size
+        )
+        future.add_done_callback(partial(_store, key))
+    return None
@@ -1,27 +1,67 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
+from rest_framework.exceptions import APIException, PermissionDenied
 from rest_framework.fields import FileField
 
-from .models import File, Folder
+from .mixins.serializers import SparseFieldsetMixin
+from .access import AccessMap
+from .blobs import store_blob
+from .uploads import split_upload_path
+from .transfers import get_transfers
+from .models import File, Folder, QuotaExceeded, StorageUsage, UploadSession
 
 User = get_user_model()
 
 
-class FileSerializer(serializers.ModelSerializer):
-    file = serializers.FileField()
+class InsufficientStorage(APIException):
+    status_code = 507
+    default_detail = "The storage quota would be exceeded."
+    default_code = "insufficient_storage"
+
+
+@extend_schema_field({"type": "string", "format": "uri"})
+class DownloadField(serializers.FileField):
+    """
+    The uploaded content on writes. On reads, the URL of the file's download
+    action rather than of the stored object, so every fetch checks access and
+    gets the content decoded.
+    """
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, file):
+        url = reverse("file-download", args=[file.pk])
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class FileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    file = DownloadField()
     owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
     name = serializers.CharField(max_length=128, required=False)
 
     class Meta:
         model = File
-        fields = ["id", "file", "name", "owner", "folder", "created_at", "updated_at"]
+        fields = ["id", "file", "name", "owner", "folder", "size", "created_at", "updated_at"]
 
     def create(self, validated_data):
         # Handle file creation
+        content = validated_data.pop('file')
         if 'name' not in validated_data or not validated_data['name']:
-            validated_data['name'] = validated_data['file'].name
-        return File.objects.create(**validated_data)
+            validated_data['name'] = content.name
+        file = File(**validated_data)
+        # Check the name before storing content that would then be unused.
+        file.check_model_has_unique_name()
+        StorageUsage.check_quota(file.owner.id, content.size)
+        file.blob = store_blob(content)
+        file.save()
+        return file
 
     def update(self, instance, validated_data):
         # Handle file updating
@@ -30,31 +70,132 @@ class FileSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class FolderSerializer(serializers.ModelSerializer):
+class FolderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Folder with its content. On reads, `?depth=<n>` sets how many levels of
+    children are nested (0 to 3, default 1) and `?summary=true` replaces the
+    nested lists with child and file counts.
+    """
+
+    DEFAULT_DEPTH = 1
+    MAX_DEPTH = 3
+
     children = serializers.SerializerMethodField()
     files = serializers.SerializerMethodField()
+    child_count = serializers.SerializerMethodField()
+    file_count = serializers.SerializerMethodField()
     owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
     class Meta:
         model = Folder
-        fields = ["id", "name", "owner", "parent", "children", "files"]
+        fields = [
+            "id",
+            "name",
+            "owner",
+            "parent",
+            "size",
+            "children",
+            "files",
+            "child_count",
+            "file_count",
+        ]
 
-    def get_children(self, obj):
-        children = (
-            obj.children.values(
-                "id",
-                "name",
-            )
-            if hasattr(obj, "children")
-            else []
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        depth, summary = self.get_content_options(self.context)
+        if summary:
+            hidden = ["children", "files"]
+        else:
+            hidden = ["child_count", "file_count"]
+            if depth == 0:
+                hidden += ["children", "files"]
+        for name in hidden:
+            self.fields.pop(name, None)
+
+    @classmethod
+    def get_content_options(cls, context):
+        """Return the (depth, summary) requested through the context or the query string."""
+        request = context.get("request")
+        query_params = getattr(request, "query_params", {})
+        summary = context.get(
+            "summary", query_params.get("summary", "").lower() in ("1", "true")
         )
-        return list(children)
+        depth = context.get("depth", query_params.get("depth", cls.DEFAULT_DEPTH))
+        try:
+            depth = int(depth)
+        except (TypeError, ValueError):
+            depth = -1
+        if not 0 <= depth <= cls.MAX_DEPTH:
+            raise serializers.ValidationError(
+                {"depth": f"Expected an integer between 0 and {cls.MAX_DEPTH}."}
+            )
+        return depth, summary
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, context):
+        """Load the content serialized for every folder of `queryset` in bulk."""
+        depth, summary = cls.get_content_options(context)
+        requested = cls.get_requested_fields(context)
+
+        def is_requested(*names):
+            return requested is None or not requested.isdisjoint(names)
+
+        if summary:
+            if not is_requested("child_count", "file_count"):
+                return queryset
+            return queryset.annotate(
+                child_count=Coalesce(
+                    Subquery(
+                        Folder.objects.filter(parent=OuterRef("pk"))
+                        .values("parent")
+                        .annotate(count=Count("pk"))
+                        .values("count")
+                    ),
+                    0,
+                ),
+                file_count=Coalesce(
+                    Subquery(
+                        File.objects.filter(folder=OuterRef("pk"))
+                        .values("folder")
+                        .annotate(count=Count("pk"))
+                        .values("count")
+                    ),
+                    0,
+                ),
+            )
+
+        if not is_requested("children", "files"):
+            return queryset
+
+        lookups = []
+        for level in range(depth):
+            prefix = "children__" * level
+            lookups += [
+                f"{prefix}children",
+                Prefetch(f"{prefix}file_set", queryset=File.objects.select_related("blob")),
+            ]
+        return queryset.prefetch_related(*lookups)
+
+    def get_children(self, obj):
+        children = obj.children.all()
+        depth, _ = self.get_content_options(self.context)
+        if depth > 1:
+            context = {**self.context, "depth": depth - 1}
+            return FolderSerializer(children, many=True, context=context).data
+        return [{"id": child.id, "name": child.name} for child in children]
 
     def get_files(self, obj):
-        if isinstance(obj, Folder):
-            files = obj.file_set.all()
-            return FileSerializer(files, many=True).data
-        return []
+        return FileSerializer(obj.file_set.all(), many=True).data
+
+    def get_child_count(self, obj):
+        if hasattr(obj, "child_count"):
+            return obj.child_count
+        return obj.children.count()
+
+    def get_file_count(self, obj):
+        if hasattr(obj, "file_count"):
+            return obj.file_count
+        return obj.file_set.count()
 
 
 class BaseShareSerializer(serializers.Serializer):
@@ -62,15 +203,25 @@ class BaseShareSerializer(serializers.Serializer):
         child=serializers.CharField(), write_only=True, required=True
     )
 
-    def validate_usernames(self, value):
-        valid_usernames = []
-        for username in value:
-            if not User.objects.filter(username=username).exists():
-                raise serializers.ValidationError(
-                    f"User with username {username} does not exist."
-                )
-            valid_usernames.append(username)
-        return valid_usernames
+    def validate(self, attrs):
+        # Resolve every username with a single query.
+        usernames = list(dict.fromkeys(attrs["usernames"]))
+        users = {
+            user.username: user
+            for user in User.objects.filter(username__in=usernames)
+        }
+        missing = [username for username in usernames if username not in users]
+        if missing:
+            raise serializers.ValidationError(
+                {
+                    "usernames": [
+                        f"User with username {username} does not exist."
+                        for username in missing
+                    ]
+                }
+            )
+        attrs["users"] = [users[username] for username in usernames]
+        return attrs
 
 
 class ShareSerializer(BaseShareSerializer):
@@ -82,3 +233,168 @@ class ShareSerializer(BaseShareSerializer):
 
 class UnshareSerializer(BaseShareSerializer):
     pass
+
+
+class BatchShareTargetsSerializer(serializers.Serializer):
+    files = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list
+    )
+    folders = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list
+    )
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if not attrs["files"] and not attrs["folders"]:
+            raise serializers.ValidationError(
+                "At least one file or folder must be given."
+            )
+        return attrs
+
+
+class BatchShareSerializer(BatchShareTargetsSerializer, ShareSerializer):
+    pass
+
+
+class BatchUnshareSerializer(BatchShareTargetsSerializer, UnshareSerializer):
+    pass
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    An upload session. Direct sessions (`direct: true`) declare the SHA-256
+    of their content and come with the presigned `upload` request that sends
+    it straight to the storage. Chunked sessions may declare it too, to have
+    the content checked on finalize.
+    """
+
+    owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    sha256 = serializers.RegexField(r"^[0-9a-f]{64}$", required=False)
+    upload = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "name",
+            "folder",
+            "owner",
+            "size",
+            "offset",
+            "direct",
+            "sha256",
+            "upload",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = ["offset"]
+
+    @extend_schema_field(
+        {
+            "type": "object",
+            "nullable": True,
+            "properties": {
+                "url": {"type": "string"},
+                "method": {"type": "string"},
+                "headers": {"type": "object"},
+            },
+        }
+    )
+    def get_upload(self, obj):
+        if not obj.direct:
+            return None
+        return get_transfers().upload_target(
+            self.context["request"], obj.staging_key, obj.size, obj.sha256
+        )
+
+    def validate(self, attrs):
+        if settings.FILE_STORAGE_BUCKET and not attrs.get("direct"):
+            # Part files live on the host receiving each chunk, which is not
+            # the same from one request to the next once there are several.
+            raise serializers.ValidationError(
+                {"direct": "Uploads go straight to the object storage: create a direct session."}
+            )
+        if attrs.get("direct") and not attrs.get("sha256"):
+            raise serializers.ValidationError(
+                {"sha256": "Direct uploads must declare the SHA-256 of their content."}
+            )
+        owner, folder = attrs["owner"], attrs.get("folder")
+        if (
+            folder
+            and folder.owner_id != owner.id
+            and not AccessMap.for_request(self.context["request"]).has_permission(folder, "can_edit")
+        ):
+            raise PermissionDenied(
+                "You do not have permission to upload a file in this location."
+            )
+        if File.objects.filter(name=attrs["name"], owner=owner, folder=folder).exists():
+            raise serializers.ValidationError(
+                {"name": f"A file with the name '{attrs['name']}' already exists in the same location for this user."}
+            )
+        try:
+            StorageUsage.check_quota(owner.id, attrs["size"])
+        except QuotaExceeded as error:
+            raise InsufficientStorage(str(error))
+        return attrs
+
+
+class BatchUploadSerializer(serializers.Serializer):
+    """
+    Many files uploaded in one request into `folder`. `paths` optionally
+    gives the relative path of each file, in the same order, whose
+    directories are created as folders.
+    """
+
+    owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    folder = serializers.PrimaryKeyRelatedField(
+        queryset=Folder.objects.all(), required=False, allow_null=True, default=None
+    )
+    files = serializers.ListField(
+        child=serializers.FileField(),
+        allow_empty=False,
+        max_length=settings.FILE_BATCH_UPLOAD_MAX_FILES,
+    )
+    paths = serializers.ListField(
+        child=serializers.CharField(max_length=1024), required=False
+    )
+
+    def validate(self, attrs):
+        owner, folder = attrs["owner"], attrs["folder"]
+        if (
+            folder
+            and folder.owner_id != owner.id
+            and not AccessMap.for_request(self.context["request"]).has_permission(folder, "can_edit")
+        ):
+            raise PermissionDenied(
+                "You do not have permission to upload a file in this location."
+            )
+        files = attrs["files"]
+        paths = attrs.get("paths") or [content.name for content in files]
+        if len(paths) != len(files):
+            raise serializers.ValidationError(
+                {"paths": "Expected one path for each file."}
+            )
+        entries, errors = [], []
+        for path, content in zip(paths, files):
+            try:
+                directories, name = split_upload_path(path)
+            except ValueError as error:
+                errors.append(str(error))
+            else:
+                entries.append((directories, name, content))
+        if errors:
+            raise serializers.ValidationError({"paths": errors})
+        attrs["entries"] = entries
+        return attrs
+
+
+class StorageUsageSerializer(serializers.ModelSerializer):
+    """The bytes a user stores, the quota that applies (null when unlimited) and what is left of it."""
+
+    quota = serializers.IntegerField(source="limit", allow_null=True, read_only=True)
+    available = serializers.IntegerField(allow_null=True, read_only=True)
+
+    class Meta:
+        model = StorageUsage
+        fields = ["used", "quota", "available"]
+        read_only_fields = ["used"]
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .access import get_share_targets
+from .models import Share
+
+
+def _targets_query(objects):
+    """Build a single filter matching the shares of every object in `objects`."""
+    object_ids_by_field = {}
+    for obj in objects:
+        object_ids_by_field.setdefault(Share.target_field(obj), []).append(obj.id)
+
+    query = Q(pk__in=[])
+    for field, object_ids in object_ids_by_field.items():
+        query |= Q(**{f"{field}__in": object_ids})
+    return query
+
+
+def share_objects(objects, users, shared_by, permissions, batch_size=1000):
+    """
+    Share every object with every user, creating or updating the shares with a
+    fixed number of queries inside a single transaction.
+    """
+    targets = _targets_query(objects)
+    with transaction.atomic():
+        existing_shares = Share.objects.filter(targets, shared_with__in=users)
+        existing = set()
+        for folder_id, file_id, user_id in existing_shares.values_list(
+            "folder_id", "file_id", "shared_with_id"
+        ):
+            target = ("folder", folder_id) if folder_id else ("file", file_id)
+            existing.add((target, user_id))
+
+        new_shares = [
+            Share(
+                shared_by=shared_by,
+                shared_with=user,
+                content_object=obj,
+                permissions=permissions,
+            )
+            for obj in objects
+            for user in users
+            if ((Share.target_field(obj), obj.id), user.id) not in existing
+        ]
+
+        if existing:
+            existing_shares.update(shared_by=shared_by, permissions=permissions)
+        Share.objects.bulk_create(new_shares, batch_size=batch_size)
+
+
+def unshare_objects(objects, users, shared_by, batch_size=1000):
+    """
+    Revoke the access of every user to every object with a fixed number of
+    queries. The shares of the objects are deleted, except where a folder
+    above still grants the user access: the share is then replaced by an
+    override without permissions, since the inherited one would apply again.
+    Returns the number of such overrides.
+    """
+    ancestors = [get_share_targets(obj)[1:] for obj in objects]
+    # Folders unshared by this same call grant nothing anymore.
+    unshared = {(Share.target_field(obj), obj.id) for obj in objects}
+    folder_ids = {pk for targets in ancestors for target, pk in targets if (target, pk) not in unshared}
+    with transaction.atomic():
+        inherited = {
+            (folder_id, user_id): permissions
+            for folder_id, user_id, permissions in Share.objects.filter(
+                folder_id__in=folder_ids, shared_with__in=users
+            ).values_list("folder_id", "shared_with_id", "permissions")
+        }
+        overrides = []
+        for obj, targets in zip(objects, ancestors):
+            for user in users:
+                permissions = next(
+                    (
+                        inherited[(pk, user.id)]
+                        for _, pk in targets
+                        if (pk, user.id) in inherited
+                    ),
+                    None,
+                )
+                if permissions:
+                    overrides.append(
+                        Share(shared_by=shared_by, shared_with=user, content_object=obj, permissions=0)
+                    )
+
+        Share.objects.filter(_targets_query(objects), shared_with__in=users).delete()
+        Share.objects.bulk_create(overrides, batch_size=batch_size)
+    return len(overrides)
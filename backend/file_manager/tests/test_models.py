@@ -1,9 +1,22 @@
+import hashlib
+import io
+import os
+import shutil
+from datetime import timedelta
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.test import TestCase
-from file_manager.models import File, Folder, Share
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from file_manager.blobs import store_blob
+from file_manager.models import Blob, File, Folder, QuotaExceeded, Share, StorageUsage, UploadSession
 
-from .config import FileMixin, FolderMixin, ShareMixin, UserMixin
+from .config import TEST_DIR, FileMixin, FolderMixin, ShareMixin, UserMixin
 
 User = get_user_model()
 
@@ -47,3 +60,356 @@ class FileManagerTestCase(TestCase, UserMixin, FileMixin, FolderMixin, ShareMixi
         self.assertFalse(share.can_edit)
         self.assertFalse(share.can_share)
 
+
+class FolderPathTestCase(TestCase, UserMixin, FolderMixin, FileMixin):
+
+    def setUp(self):
+        self.user = self.create_user('user1', 'password123')
+        self.root = self.create_folder('Root', self.user)
+        self.child = self.create_folder('Child', self.user, self.root)
+        self.grandchild = self.create_folder('Grandchild', self.user, self.child)
+        self.other_root = self.create_folder('OtherRoot', self.user)
+
+    def test_path_is_built_on_create(self):
+        self.assertEqual(self.root.path, f'/{self.root.id}/')
+        self.assertEqual(
+            self.grandchild.path, f'/{self.root.id}/{self.child.id}/{self.grandchild.id}/'
+        )
+        self.assertEqual(self.grandchild.ancestor_ids, [self.root.id, self.child.id])
+
+    def test_ancestors_and_descendants(self):
+        self.assertEqual(self.grandchild.get_ancestors(), [self.root, self.child])
+        self.assertEqual(
+            set(self.root.get_descendants()), {self.child, self.grandchild}
+        )
+        self.assertEqual(str(self.grandchild), 'Root::Child::Grandchild')
+
+    def test_str_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            str(self.grandchild)
+
+    def test_move_rewrites_subtree_paths(self):
+        self.child.parent = self.other_root
+        self.child.save()
+
+        self.grandchild.refresh_from_db()
+        self.assertEqual(
+            self.grandchild.path,
+            f'/{self.other_root.id}/{self.child.id}/{self.grandchild.id}/',
+        )
+        self.assertEqual(list(self.root.get_descendants()), [])
+
+    def test_move_into_descendant_is_rejected(self):
+        self.root.parent = self.grandchild
+        with self.assertRaises(ValidationError):
+            self.root.save()
+
+    def test_paths_that_would_not_fit_are_rejected(self):
+        deep_path = '/' + '1/' * 382 + f'{self.other_root.id}/'
+        Folder.objects.filter(pk=self.other_root.pk).update(path=deep_path)
+
+        with self.assertRaises(ValidationError):
+            self.create_folder('TooDeep', self.user, self.other_root)
+        self.child.parent = self.other_root
+        with self.assertRaises(ValidationError):
+            self.child.save()
+        self.grandchild.refresh_from_db()
+        self.assertEqual(
+            self.grandchild.path, f'/{self.root.id}/{self.child.id}/{self.grandchild.id}/'
+        )
+
+        # Folders already that deep can still be renamed.
+        self.other_root.name = 'Renamed'
+        self.other_root.save()
+
+    def test_rename_with_stale_path_keeps_stored_path(self):
+        stale = Folder.objects.get(pk=self.grandchild.pk)
+        self.child.parent = self.other_root
+        self.child.save()
+
+        stale.name = 'Renamed'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(
+            stale.path, f'/{self.other_root.id}/{self.child.id}/{self.grandchild.id}/'
+        )
+
+    def test_delete_removes_subtree(self):
+        self.create_file('File1', self.grandchild, self.user)
+        self.root.delete()
+        self.assertEqual(list(Folder.objects.all()), [self.other_root])
+        self.assertFalse(File.objects.exists())
+
+
+class SharePermissionMaskTestCase(TestCase, UserMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1', 'password123')
+        self.user2 = self.create_user('user2', 'password123')
+        self.folder = self.create_folder('Folder1', self.user1)
+
+    def test_flags_are_stored_in_mask(self):
+        share = self.create_share(
+            self.user1, self.user2, self.folder, can_read=True, can_share=True
+        )
+        share.refresh_from_db()
+        self.assertEqual(share.permissions, Share.READ | Share.SHARE)
+        share.can_read = False
+        self.assertEqual(share.permissions, Share.SHARE)
+
+    def test_has_lookup_requires_every_bit(self):
+        self.create_share(self.user1, self.user2, self.folder, can_edit=True)
+        self.assertTrue(Share.objects.filter(permissions__has=Share.READ | Share.EDIT).exists())
+        self.assertFalse(Share.objects.filter(permissions__has=Share.READ | Share.DELETE).exists())
+
+
+class ShareTargetTestCase(TestCase, UserMixin, FolderMixin, FileMixin, ShareMixin):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1', 'password123')
+        self.user2 = self.create_user('user2', 'password123')
+        self.folder = self.create_folder('Folder1', self.user1)
+        self.file = self.create_file('File1', self.folder, self.user1)
+
+    def test_shares_are_deleted_with_their_target(self):
+        self.create_share(self.user1, self.user2, self.folder)
+        self.create_share(self.user1, self.user2, self.file)
+        self.folder.delete()
+        self.assertFalse(Share.objects.exists())
+
+    def test_share_needs_exactly_one_target(self):
+        with self.assertRaises(IntegrityError):
+            Share.objects.create(
+                shared_by=self.user1, shared_with=self.user2, file=self.file, folder=self.folder
+            )
+
+    def test_content_object(self):
+        share = self.create_share(self.user1, self.user2, self.folder)
+        self.assertEqual(share.content_object, self.folder)
+        self.assertIsNone(share.file)
+
+
+class BlobTestCase(TestCase, UserMixin, FolderMixin, FileMixin):
+
+    def setUp(self):
+        self.user = self.create_user('user1', 'password123')
+        self.folder = self.create_folder('Folder1', self.user)
+        self.subfolder = self.create_folder('Folder2', self.user, self.folder)
+
+    def test_identical_content_is_stored_once(self):
+        file1 = self.create_file('File1', self.folder, self.user, content=b'same')
+        file2 = self.create_file('File2', self.subfolder, self.user, content=b'same')
+        other = self.create_file('File3', self.folder, self.user, content=b'other')
+
+        self.assertEqual(file1.blob, file2.blob)
+        self.assertNotEqual(file1.blob, other.blob)
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(file1.content_hash, hashlib.sha256(b'same').hexdigest())
+        self.assertTrue(file1.file.name.startswith(f'blobs/{file1.content_hash[:2]}/'))
+        file1.blob.refresh_from_db()
+        self.assertEqual((file1.blob.size, file1.blob.ref_count), (4, 2))
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_losing_a_concurrent_write_keeps_the_stored_content(self):
+        self.addCleanup(shutil.rmtree, TEST_DIR + '/media', ignore_errors=True)
+        content = b'text ' * 1024
+        stored = store_blob(ContentFile(content, name='data.txt'))
+        with stored.file.open('rb') as stored_file:
+            stored_bytes = stored_file.read()
+
+        # Another upload of the same content, which missed the blob before inserting its own.
+        with mock.patch.object(Blob.objects, 'filter', return_value=Blob.objects.none()):
+            blob = store_blob(ContentFile(content, name='data.bin'))
+        self.assertEqual(blob, stored)
+        self.assertEqual(blob.encoding, stored.encoding)
+        with blob.file.open('rb') as blob_file:
+            self.assertEqual(blob_file.read(), stored_bytes)
+        self.assertEqual(os.listdir(os.path.join(TEST_DIR, 'media', 'uploads')), [])
+
+    def test_deletes_release_references(self):
+        file1 = self.create_file('File1', self.folder, self.user, content=b'same')
+        self.create_file('File2', self.subfolder, self.user, content=b'same')
+        self.create_file('File3', self.subfolder, self.user, content=b'same')
+
+        file1.delete()
+        file1.blob.refresh_from_db()
+        self.assertEqual(file1.blob.ref_count, 2)
+
+        self.folder.delete()
+        file1.blob.refresh_from_db()
+        self.assertEqual(file1.blob.ref_count, 0)
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class GarbageCollectionTestCase(TestCase, UserMixin, FolderMixin, FileMixin):
+
+    def setUp(self):
+        self.user = self.create_user('user1', 'password123')
+        self.folder = self.create_folder('Folder1', self.user)
+
+    def collect(self, *args):
+        output = io.StringIO()
+        call_command('collect_garbage', *args, stdout=output)
+        return output.getvalue()
+
+    def test_orphaned_blobs_are_deleted_after_the_grace_period(self):
+        kept = self.create_file('Kept', self.folder, self.user, content=b'kept')
+        orphan = self.create_file('Orphan', self.folder, self.user, content=b'orphan')
+        orphan.delete()
+        path = orphan.file.path
+
+        self.collect()
+        blob = Blob.objects.get(pk=orphan.blob_id)
+        self.assertIsNotNone(blob.orphaned_at)
+        self.assertTrue(os.path.exists(path))
+
+        Blob.objects.filter(pk=blob.pk).update(orphaned_at=timezone.now() - timedelta(days=2))
+        self.assertIn('Deleted 1 orphaned blob(s)', self.collect())
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(kept.file.path))
+
+    def test_reused_blobs_are_no_longer_orphans(self):
+        orphan = self.create_file('Orphan', self.folder, self.user, content=b'same')
+        orphan.delete()
+        self.collect()
+        reused = self.create_file('Reused', self.folder, self.user, content=b'same')
+        self.assertEqual(reused.blob_id, orphan.blob_id)
+
+        Blob.objects.filter(pk=reused.blob_id).update(orphaned_at=timezone.now() - timedelta(days=2))
+        Blob.objects.filter(pk=reused.blob_id).update(ref_count=0)
+        self.collect()
+        self.assertTrue(Blob.objects.filter(pk=reused.blob_id).exists())
+
+    def test_unreferenced_stored_objects_are_deleted(self):
+        kept = self.create_file('Kept', self.folder, self.user)
+        stray = default_storage.save('blobs/00/00/stray', ContentFile(b'stray'))
+        legacy = default_storage.save('files/legacy.txt', ContentFile(b'legacy'))
+
+        self.collect()
+        self.assertTrue(default_storage.exists(stray))
+
+        output = self.collect('--grace-period', '0')
+        self.assertIn('2 unreferenced stored object(s)', output)
+        self.assertFalse(default_storage.exists(stray))
+        self.assertFalse(default_storage.exists(legacy))
+        self.assertTrue(default_storage.exists(kept.file.name))
+
+    def test_upload_session_content_is_collected(self):
+        active = UploadSession.objects.create(owner=self.user, folder=self.folder, name='a.bin', size=10)
+        lost = UploadSession.objects.create(owner=self.user, folder=self.folder, name='b.bin', size=10)
+        for session in (active, lost):
+            os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+            with open(session.part_path, 'wb') as part:
+                part.write(b'12345')
+        # Left behind by a cascade that skipped UploadSession.delete.
+        UploadSession.objects.filter(pk=lost.pk).delete()
+
+        self.assertIn('1 unreferenced stored object(s)', self.collect('--grace-period', '0'))
+        self.assertTrue(os.path.exists(active.part_path))
+        self.assertFalse(os.path.exists(lost.part_path))
+
+    def test_folder_delete_removes_upload_session_content(self):
+        child = self.create_folder('Child', self.user, parent=self.folder)
+        session = UploadSession.objects.create(owner=self.user, folder=child, name='a.bin', size=10)
+        os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+        with open(session.part_path, 'wb') as part:
+            part.write(b'12345')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.folder.delete()
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.part_path))
+
+    def test_recount_fixes_references_left_by_cascades(self):
+        file = self.create_file('File1', self.folder, self.user)
+        self.user.delete()
+        blob = Blob.objects.get(pk=file.blob_id)
+        self.assertEqual(blob.ref_count, 1)
+
+        self.assertIn('fixed 1 reference count(s)', self.collect('--recount', '--batch-size', '1'))
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertIsNotNone(blob.orphaned_at)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class StorageUsageTestCase(TestCase, UserMixin, FolderMixin, FileMixin):
+
+    def setUp(self):
+        self.user = self.create_user('user1', 'password123')
+        self.root = self.create_folder('Root', self.user)
+        self.child = self.create_folder('Child', self.user, parent=self.root)
+        self.other = self.create_folder('Other', self.user)
+
+    def sizes(self, *folders):
+        return [Folder.objects.get(pk=folder.pk).size for folder in folders]
+
+    def used(self):
+        return StorageUsage.objects.get(user=self.user).used
+
+    def test_sizes_follow_files_and_folders(self):
+        file = self.create_file('File1', self.child, self.user, content=b'12345')
+        self.create_file('File2', self.root, self.user, content=b'123')
+        self.assertEqual(file.size, 5)
+        self.assertEqual(self.sizes(self.root, self.child, self.other), [8, 5, 0])
+        self.assertEqual(self.used(), 8)
+
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(self.sizes(self.root, self.child, self.other), [3, 5, 5])
+
+        file.delete()
+        self.assertEqual(self.sizes(self.root, self.child, self.other), [3, 0, 0])
+        self.assertEqual(self.used(), 3)
+
+        self.root.delete()
+        self.assertEqual(self.used(), 0)
+
+    def test_deleting_a_subtree_updates_the_ancestors(self):
+        self.create_file('File1', self.child, self.user, content=b'12345')
+        grandchild = self.create_folder('Grandchild', self.user, parent=self.child)
+        self.create_file('File2', grandchild, self.user, content=b'123')
+        self.assertEqual(self.sizes(self.root, self.child), [8, 8])
+
+        grandchild.delete()
+        self.assertEqual(self.sizes(self.root, self.child), [5, 5])
+        self.assertEqual(self.used(), 5)
+
+    def test_quota_is_enforced(self):
+        StorageUsage.objects.create(user=self.user, quota=10)
+        self.create_file('File1', self.root, self.user, content=b'1234567')
+        with self.assertRaises(QuotaExceeded):
+            self.create_file('File2', self.root, self.user, content=b'1234')
+        self.assertFalse(File.objects.filter(name='File2').exists())
+        self.assertEqual(self.used(), 7)
+        self.assertEqual(self.sizes(self.root), [7])
+
+    @override_settings(FILE_DEFAULT_QUOTA=5)
+    def test_default_quota_applies_without_a_quota_of_their_own(self):
+        with self.assertRaises(QuotaExceeded):
+            self.create_file('File1', self.root, self.user, content=b'123456')
+        self.create_file('File2', self.root, self.user, content=b'12345')
+        self.assertEqual(StorageUsage.objects.get(user=self.user).available, 0)
+
+    def test_recount_fixes_sizes_left_by_cascades(self):
+        other_user = self.create_user('user2', 'password123')
+        self.create_file('File1', self.child, self.user, content=b'12345')
+        self.create_file('File2', self.child, other_user, content=b'123')
+        other_user.delete()
+        self.assertEqual(self.sizes(self.root, self.child), [8, 8])
+        StorageUsage.objects.filter(user=self.user).update(used=0)
+
+        output = io.StringIO()
+        call_command('recount_storage_usage', stdout=output)
+        self.assertIn('usage of 1 user(s)', output.getvalue())
+        self.assertEqual(self.sizes(self.root, self.child, self.other), [5, 5, 0])
+        self.assertEqual(self.used(), 5)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
 from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from file_manager.models import Share
 from file_manager.permissions import (CanDelete, CanEdit, CanEditParentFolder,
                                       CanRead, CanShare, IsOwner)
 from rest_framework.views import APIView
@@ -35,14 +38,14 @@ class PermissionTestCase(TestCase, UserMixin, FolderMixin, FileMixin, ShareMixin
 
         request.user = self.user1
         request.data = {"parent": self.folder1.id}
-        self.assertTrue(permission.has_object_permission(request, self.view))
+        self.assertTrue(permission.has_permission(request, self.view))
 
         request.user = self.user2
-        self.assertFalse(permission.has_object_permission(request, self.view))
+        self.assertFalse(permission.has_permission(request, self.view))
 
         # Testing creation at root level (no parent)
         request.data = {"parent": None}
-        self.assertTrue(permission.has_object_permission(request, self.view))
+        self.assertTrue(permission.has_permission(request, self.view))
 
 
 class IsOwnerPermissionTest(PermissionTestCase):
@@ -87,7 +90,7 @@ class CanEditParentFolderPermissionTest(PermissionTestCase):
         self.request.user = self.user1
         self.request.data = {"parent": self.folder1.id}
         self.assertTrue(
-            self.can_edit_parent_folder_permission.has_object_permission(
+            self.can_edit_parent_folder_permission.has_permission(
                 self.request, self.view
             )
         )
@@ -96,7 +99,7 @@ class CanEditParentFolderPermissionTest(PermissionTestCase):
         self.request.user = self.user2  # Not the owner of folder1
         self.request.data = {"parent": self.folder1.id}
         self.assertFalse(
-            self.can_edit_parent_folder_permission.has_object_permission(
+            self.can_edit_parent_folder_permission.has_permission(
                 self.request, self.view
             )
         )
@@ -105,7 +108,7 @@ class CanEditParentFolderPermissionTest(PermissionTestCase):
         self.request.user = self.user1
         self.request.data = {"parent": None}
         self.assertTrue(
-            self.can_edit_parent_folder_permission.has_object_permission(
+            self.can_edit_parent_folder_permission.has_permission(
                 self.request, self.view
             )
         )
@@ -175,3 +178,109 @@ class CanDeletePermissionTest(PermissionTestCase):
                 self.request, self.view, self.file1
             )
         )
+
+
+class InheritedSharePermissionTest(TestCase, UserMixin, FolderMixin, FileMixin, ShareMixin):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.view = APIView()
+        self.request = self.factory.get("/")
+        self.can_read_permission = CanRead()
+        self.can_edit_permission = CanEdit()
+        self.can_edit_parent_folder_permission = CanEditParentFolder()
+
+        self.user1 = self.create_user("user1", "password123")
+        self.user2 = self.create_user("user2", "password123")
+        self.folder1 = self.create_folder("Folder1", self.user1)
+        self.subfolder = self.create_folder("Subfolder", self.user1, self.folder1)
+        self.nested_file = self.create_file("Nested", self.subfolder, self.user1)
+        self.folder_share = self.create_share(
+            self.user1, self.user2, self.folder1, can_read=True, can_edit=True
+        )
+
+    def test_folder_share_applies_to_subtree(self):
+        self.request.user = self.user2
+        for obj in (self.subfolder, self.nested_file):
+            self.assertTrue(
+                self.can_read_permission.has_object_permission(
+                    self.request, self.view, obj
+                )
+            )
+            self.assertTrue(
+                self.can_edit_permission.has_object_permission(
+                    self.request, self.view, obj
+                )
+            )
+
+    def test_descendant_share_overrides_inherited_share(self):
+        self.create_share(
+            self.user1, self.user2, self.subfolder, can_read=True, can_edit=False
+        )
+        self.request.user = self.user2
+        self.assertFalse(
+            self.can_edit_permission.has_object_permission(
+                self.request, self.view, self.nested_file
+            )
+        )
+        self.assertTrue(
+            self.can_edit_permission.has_object_permission(
+                self.request, self.view, self.folder1
+            )
+        )
+
+    def test_new_objects_do_not_copy_shares(self):
+        shares = Share.objects.count()
+        self.create_file("Upload", self.subfolder, self.user1)
+        self.create_folder("NewFolder", self.user1, self.subfolder)
+        self.assertEqual(Share.objects.count(), shares)
+
+    def test_can_edit_parent_folder_is_inherited(self):
+        request = self.factory.post("/")
+        request.user = self.user2
+        request.data = {"parent": self.subfolder.id}
+        self.assertTrue(
+            self.can_edit_parent_folder_permission.has_permission(
+                request, self.view
+            )
+        )
+
+
+class RequestAccessMapTest(TestCase, UserMixin, FolderMixin, FileMixin, ShareMixin):
+    def setUp(self):
+        self.view = APIView()
+        self.user1 = self.create_user("user1", "password123")
+        self.user2 = self.create_user("user2", "password123")
+        self.folder1 = self.create_folder("Folder1", self.user1)
+        self.subfolder = self.create_folder("Subfolder", self.user1, self.folder1)
+        self.files = [
+            self.create_file(f"File{index}", self.subfolder, self.user1)
+            for index in range(5)
+        ]
+        self.create_share(self.user1, self.user2, self.folder1, can_read=True)
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user2
+
+    def test_single_share_query_per_request(self):
+        permissions = [(IsOwner | CanRead)(), (IsOwner | CanEdit)(), CanShare()]
+        for file in self.files:
+            file.folder = self.subfolder
+
+        with CaptureQueriesContext(connection) as queries:
+            for permission in permissions:
+                for obj in [self.folder1, self.subfolder] + self.files:
+                    permission.has_object_permission(self.request, self.view, obj)
+
+        share_queries = [
+            query for query in queries if Share._meta.db_table in query["sql"]
+        ]
+        self.assertEqual(len(share_queries), 1)
+
+    def test_access_map_is_reloaded_for_another_user(self):
+        permission = CanRead()
+        self.assertTrue(
+            permission.has_object_permission(self.request, self.view, self.files[0])
+        )
+        self.request.user = self.create_user("user3", "password123")
+        self.assertFalse(
+            permission.has_object_permission(self.request, self.view, self.files[0])
+        )
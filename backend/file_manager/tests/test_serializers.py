@@ -1,8 +1,9 @@
 import shutil
 
-from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
 from file_manager.models import File, Folder
 from file_manager.serializers import (FileSerializer, FolderSerializer,
                                       ShareSerializer, UnshareSerializer)
@@ -21,13 +22,64 @@ class FileSerializerTest(TestCase, UserMixin, FolderMixin, FileMixin):
         data = self.serializer.data
         self.assertEqual(
             set(data.keys()),
-            set(["id", "name", "file", "folder", "created_at", "updated_at"]),
+            set(["id", "name", "file", "folder", "size", "created_at", "updated_at"]),
         )
 
     def test_file_field_content(self):
         data = self.serializer.data
-        file_url = settings.MEDIA_URL + self.file.file.name
-        self.assertEqual(data["file"], file_url)
+        self.assertEqual(data["file"], reverse("file-download", args=[self.file.pk]))
+
+
+
+
+class FolderSerializerTest(TestCase, UserMixin, FolderMixin, FileMixin):
+    def setUp(self):
+        self.user = self.create_user("user1", "password123")
+        self.roots = []
+        for index in range(3):
+            root = self.create_folder(f"Root{index}", self.user)
+            child = self.create_folder("Child", self.user, root)
+            self.create_folder("Grandchild", self.user, child)
+            self.create_file("File1", root, self.user)
+            self.create_file("File2", child, self.user)
+            self.roots.append(root)
+        self.queryset = Folder.objects.filter(parent__isnull=True)
+
+    def serialize(self, **context):
+        queryset = FolderSerializer.setup_eager_loading(self.queryset, context)
+        return FolderSerializer(queryset, many=True, context=context).data
+
+    def test_default_depth_matches_flat_children(self):
+        data = self.serialize()
+        self.assertEqual(data[0]["children"], [{"id": self.roots[0].children.get().id, "name": "Child"}])
+        self.assertEqual([file["name"] for file in data[0]["files"]], ["File1"])
+
+    def test_query_count_does_not_depend_on_folder_count(self):
+        with self.assertNumQueries(3):
+            self.serialize()
+        with self.assertNumQueries(5):
+            self.serialize(depth=2)
+
+    def test_nested_depth(self):
+        data = self.serialize(depth=2)
+        child = data[0]["children"][0]
+        self.assertEqual(child["name"], "Child")
+        self.assertEqual(child["children"][0]["name"], "Grandchild")
+        self.assertEqual([file["name"] for file in child["files"]], ["File2"])
+
+        data = self.serialize(depth=0)
+        self.assertNotIn("children", data[0])
+
+    def test_summary_mode(self):
+        with self.assertNumQueries(1):
+            data = self.serialize(summary=True)
+        self.assertEqual((data[0]["child_count"], data[0]["file_count"]), (1, 1))
+        self.assertNotIn("children", data[0])
+
+    def test_invalid_depth(self):
+        with self.assertRaises(ValidationError):
+            self.serialize(depth=10)
+
 
 def tearDownModule():
     print("Deleting temporary files...")
@@ -35,4 +87,3 @@ def tearDownModule():
         shutil.rmtree(TEST_DIR)
     except OSError:
         pass
-
@@ -1,16 +1,34 @@
+import gzip
+import hashlib
+import io
 import os
+import json
 import shutil
+import struct
+import time
+import zipfile
+import zlib
+from datetime import timedelta
 
+from asgiref.testing import ApplicationCommunicator
+from core.asgi import application
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import close_old_connections, connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from file_manager.models import File, Folder, Share
+from django.utils import timezone
+from file_manager.models import Blob, File, Folder, Share, StorageUsage, UploadSession
 from file_manager.tests.config import (FileMixin, FolderMixin, ShareMixin,
                                        UserMixin)
+from PIL import Image
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
 
 User = get_user_model()
@@ -33,6 +51,13 @@ class FolderViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['name'], 'New Folder')
 
+    def test_create_folder_requires_edit_permission_on_the_parent(self):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('folder-list')
+        response = self.client.post(url, {'name': 'Intruder', 'parent': self.folder.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Folder.objects.filter(name='Intruder').exists())
+
     def test_retrieve_folder(self):
         url = reverse('folder-detail', kwargs={'pk': self.folder.pk})
         response = self.client.get(url)
@@ -67,7 +92,7 @@ class FolderViewSetTest(APITestCase):
         url = reverse('folder-personal')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn(self.folder.name, [f['name'] for f in response.data])
+        self.assertIn(self.folder.name, [f['name'] for f in response.data['results']])
 
     def test_shared_with_me_folders(self):
         self.client.force_authenticate(user=self.user2)
@@ -76,18 +101,15 @@ class FolderViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_share_modify_delete_flow(self):
-        folder_content_type = ContentType.objects.get_for_model(Folder)
         share_url = reverse('folder-share', kwargs={'pk': self.folder.pk})
         share_data = {'usernames': [self.user2.username], 'can_read': True, 'can_edit': False}
         response = self.client.post(share_url, share_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         self.assertTrue(Share.objects.filter(
-            content_type=folder_content_type,
-            object_id=self.folder.id,
+            folder=self.folder,
             shared_with=self.user2,
-            can_read=True,
-            can_edit=False
+            permissions=Share.READ,
         ).exists())
 
         # Modify the share
@@ -97,11 +119,9 @@ class FolderViewSetTest(APITestCase):
 
         # Check that the permissions have been updated
         self.assertTrue(Share.objects.filter(
-            content_type=folder_content_type,
-            object_id=self.folder.id,
+            folder=self.folder,
             shared_with=self.user2,
-            can_read=True,
-            can_edit=True
+            permissions=Share.READ | Share.EDIT,
         ).exists())
 
         # Unshare the folder with user2
@@ -112,8 +132,7 @@ class FolderViewSetTest(APITestCase):
 
         # Check that the share has been deleted
         self.assertFalse(Share.objects.filter(
-            content_type=folder_content_type,
-            object_id=self.folder.id,
+            folder=self.folder,
             shared_with=self.user2
         ).exists())
 
@@ -144,6 +163,33 @@ class FileViewSetTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin
         self.assertIn('file', response.data)
         self.assertIn('name', response.data)
 
+    def test_create_file_requires_edit_permission_on_the_folder(self):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('file-list')
+        upload = SimpleUploadedFile('intruder', b'content', content_type='text/plain')
+        response = self.client.post(url, {'file': upload, 'folder': self.folder1.id}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(File.objects.filter(name='intruder').exists())
+        self.folder1.refresh_from_db()
+        self.assertEqual(self.folder1.size, self.file1.size)
+
+        self.create_share(self.user1, self.user2, self.folder1, can_edit=True)
+        upload = SimpleUploadedFile('intruder', b'content', content_type='text/plain')
+        response = self.client.post(url, {'file': upload, 'folder': self.folder1.id}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_upload_reuses_stored_content(self):
+        self.client.force_authenticate(user=self.user1)
+        url = reverse('file-list')
+        for name in ('copy1', 'copy2'):
+            upload = SimpleUploadedFile(name, b'Dummy file content', content_type='text/plain')
+            response = self.client.post(url, {'file': upload, 'folder': self.folder2.id}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(Blob.objects.get().ref_count, 3)
+        self.assertEqual(response.data['name'], 'copy2')
+
     def test_retrieve_file(self):
         self.client.force_authenticate(user=self.user1)
         url = reverse('file-detail', kwargs={'pk': self.file1.pk})
@@ -178,12 +224,41 @@ class FileViewSetTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_unshare_inside_shared_folder_revokes_inherited_access(self):
+        self.create_share(self.user1, self.user2, self.folder1)
+        self.client.force_authenticate(user=self.user1)
+        for name in ('file-unshare', 'folder-unshare'):
+            target = self.file1 if name == 'file-unshare' else self.folder2
+            url = reverse(name, kwargs={'pk': target.pk})
+            response = self.client.post(url, {'usernames': [self.user2.username]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(Share.objects.filter(shared_with=self.user2).values_list('folder', 'file', 'permissions')),
+            {(self.folder1.id, None, Share.READ), (None, self.file1.id, 0), (self.folder2.id, None, 0)},
+        )
+
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(reverse('file-detail', kwargs={'pk': self.file1.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('folder-detail', kwargs={'pk': self.folder2.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # Unsharing the folder itself leaves nothing to override.
+        self.client.force_authenticate(user=self.user1)
+        url = reverse('share-batch-unshare')
+        data = {'files': [self.file1.id], 'folders': [self.folder1.id], 'usernames': [self.user2.username]}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(Share.objects.filter(shared_with=self.user2).values_list('folder', flat=True)), [self.folder2.id]
+        )
+
     def test_personal_files(self):
         self.client.force_authenticate(user=self.user1)
         url = reverse('file-personal')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn(self.file1.name, [f['name'] for f in response.data])
+        self.assertIn(self.file1.name, [f['name'] for f in response.data['results']])
 
     def test_shared_with_me_files(self):
         self.client.force_authenticate(user=self.user2)
@@ -194,3 +269,948 @@ class FileViewSetTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin
     def tearDown(self):
         if os.path.exists(TEST_DIR + '/media'):
             shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class BatchUploadTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = self.create_user('owner', 'password123')
+        self.other = self.create_user('other', 'password123')
+        self.folder = self.create_folder('Uploads', self.owner)
+        self.existing = self.create_folder('docs', self.owner, parent=self.folder)
+        self.url = reverse('file-batch')
+        self.client.force_authenticate(user=self.owner)
+
+    def upload(self, files, **data):
+        uploads = [SimpleUploadedFile(name, content) for name, content in files]
+        return self.client.post(self.url, {'files': uploads, **data}, format='multipart')
+
+    def test_batch_creates_folders_and_files(self):
+        files = [('a.txt', b'same'), ('b.txt', b'same'), ('c.txt', b'other')]
+        paths = ['a.txt', 'docs/b.txt', 'docs/new/deep/c.txt']
+        response = self.upload(files, folder=self.folder.id, paths=paths)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([file['name'] for file in response.data], ['a.txt', 'b.txt', 'c.txt'])
+
+        new = Folder.objects.get(name='new', parent=self.existing)
+        deep = Folder.objects.get(name='deep', parent=new)
+        self.assertEqual(deep.path, f'{new.path}{deep.id}/')
+        self.assertEqual(deep.get_ancestors(), [self.folder, self.existing, new])
+        self.assertEqual(Folder.objects.filter(name='docs').count(), 1)
+
+        c = File.objects.get(name='c.txt')
+        self.assertEqual(c.folder, deep)
+        with c.file.open('rb') as content:
+            self.assertEqual(content.read(), b'other')
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(File.objects.get(name='b.txt').blob.ref_count, 2)
+
+    def test_batch_defaults_to_file_names_at_the_root(self):
+        response = self.upload([('a.txt', b'a'), ('b.txt', b'b')])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(File.objects.filter(owner=self.owner, folder=None).count(), 2)
+
+    def test_name_conflicts_reject_the_whole_batch(self):
+        self.create_file('b.txt', self.existing, self.owner)
+        response = self.upload(
+            [('a.txt', b'a'), ('b.txt', b'b')], folder=self.folder.id, paths=['sub/a.txt', 'docs/b.txt']
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Folder.objects.filter(name='sub').exists())
+        self.assertFalse(File.objects.filter(name='a.txt').exists())
+
+        response = self.upload([('a.txt', b'a'), ('a.txt', b'b')], folder=self.folder.id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_paths_cannot_escape_the_folder(self):
+        for path in ('../a.txt', 'docs//a.txt', '/a.txt'):
+            response = self.upload([('a.txt', b'a')], folder=self.folder.id, paths=[path])
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+
+    def test_folders_nested_too_deeply_reject_the_batch(self):
+        # Leaves room for 'x' but not for 'x/y'.
+        deep_path = f"/{'1' * (744 - len(str(self.folder.id)))}/{self.folder.id}/"
+        Folder.objects.filter(pk=self.folder.pk).update(path=deep_path)
+        response = self.upload([('a.txt', b'a')], folder=self.folder.id, paths=['x/y/a.txt'])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['files'], ["The folder 'x/y' would be nested too deeply."])
+        self.assertFalse(Folder.objects.filter(name='x').exists())
+        self.assertFalse(File.objects.exists())
+
+    def test_query_count_does_not_depend_on_file_count(self):
+        # The first upload of a user also creates their storage usage row.
+        self.upload([('first', b'first')])
+        with CaptureQueriesContext(connection) as one_file:
+            self.upload([('f0', b'0')], folder=self.folder.id, paths=['x/y/f0'])
+        files = [(f'f{index}', str(index).encode()) for index in range(10)]
+        with CaptureQueriesContext(connection) as many_files:
+            self.upload(files, folder=self.folder.id, paths=[f'z/w/{name}' for name, _ in files])
+        self.assertEqual(File.objects.count(), 12)
+        self.assertEqual(len(one_file), len(many_files))
+
+    def test_batch_requires_edit_permission(self):
+        self.client.force_authenticate(user=self.other)
+        response = self.upload([('a.txt', b'a')], folder=self.folder.id)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.create_share(self.owner, self.other, self.folder, can_edit=True)
+        response = self.upload([('a.txt', b'a')], folder=self.folder.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(File.objects.get(name='a.txt').owner, self.other)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class StorageQuotaTest(APITestCase, UserMixin, FileMixin, FolderMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = self.create_user('user1', 'password123')
+        self.folder = self.create_folder('Folder1', self.user)
+        StorageUsage.objects.create(user=self.user, quota=10)
+        self.client.force_authenticate(user=self.user)
+
+    def test_uploads_over_quota_are_rejected_before_storing(self):
+        response = self.client.post(
+            reverse('file-list'),
+            {'file': SimpleUploadedFile('big.txt', b'x' * 11), 'folder': self.folder.id},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_507_INSUFFICIENT_STORAGE)
+        self.assertFalse(Blob.objects.exists())
+
+        response = self.client.post(
+            reverse('file-batch'),
+            {'files': [SimpleUploadedFile('a.txt', b'123456'), SimpleUploadedFile('b.txt', b'654321')]},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_507_INSUFFICIENT_STORAGE)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+        response = self.client.post(reverse('upload-list'), {'name': 'big.bin', 'size': 11})
+        self.assertEqual(response.status_code, status.HTTP_507_INSUFFICIENT_STORAGE)
+
+    def test_batch_sizes_and_usage(self):
+        response = self.client.post(
+            reverse('file-batch'),
+            {
+                'files': [SimpleUploadedFile('a.txt', b'123'), SimpleUploadedFile('b.txt', b'12345')],
+                'paths': ['a.txt', 'sub/b.txt'],
+                'folder': self.folder.id,
+            },
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([file['size'] for file in response.data], [3, 5])
+        self.assertEqual(Folder.objects.get(pk=self.folder.pk).size, 8)
+        self.assertEqual(Folder.objects.get(name='sub').size, 5)
+
+        response = self.client.get(reverse('usage'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'used': 8, 'quota': 10, 'available': 2})
+
+    def test_usage_without_files(self):
+        other = self.create_user('user2', 'password123')
+        self.client.force_authenticate(user=other)
+        response = self.client.get(reverse('usage'))
+        self.assertEqual(response.data, {'used': 0, 'quota': None, 'available': None})
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class FileDownloadTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = self.create_user('user1', 'password123')
+        self.user2 = self.create_user('user2', 'password123')
+        self.content = b'0123456789abcdefghij'
+        self.file = self.create_file('File1.txt', None, self.user1, content=self.content)
+        self.url = reverse('file-download', kwargs={'pk': self.file.pk})
+        self.client.force_authenticate(user=self.user1)
+
+    def test_full_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], '"%s"' % hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+
+    def test_download_requires_read_permission(self):
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.create_share(self.user1, self.user2, self.file)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5-9')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 5-9/20')
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'hij')
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,10-11,1-2')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-2/20\r\n\r\n012\r\n', body)
+        self.assertIn(b'Content-Range: bytes 10-11/20\r\n\r\nab\r\n', body)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=50-60')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */20')
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_redirect_to_presigned_url(self):
+        with self.settings(FILE_DOWNLOAD_OFFLOAD='redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+
+        response = APIClient().get(response['Location'], HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'0123')
+
+    def test_offload_to_proxy(self):
+        with self.settings(FILE_DOWNLOAD_OFFLOAD='x-accel-redirect'):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file.file.name)
+            self.assertEqual(response['ETag'], '"%s"' % self.file.content_hash)
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.settings(FILE_DOWNLOAD_OFFLOAD='x-sendfile'):
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Sendfile'], os.path.abspath(self.file.file.path))
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class FileDeltaTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = self.create_user('owner', 'password123')
+        self.other = self.create_user('other', 'password123')
+        self.content = os.urandom(10 * 1024 + 100)
+        self.file = self.create_file('data.bin', None, self.owner, content=self.content)
+        self.etag = '"%s"' % self.file.content_hash
+        self.client.force_authenticate(user=self.owner)
+
+    @staticmethod
+    def copy(first, count):
+        return b'C' + struct.pack('>QI', first, count)
+
+    @staticmethod
+    def data(content):
+        return b'D' + struct.pack('>I', len(content)) + content
+
+    def send_delta(self, delta, etag=None, **params):
+        url = reverse('file-delta', kwargs={'pk': self.file.pk})
+        params.setdefault('block_size', 1024)
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        headers = {'HTTP_IF_MATCH': etag or self.etag} if etag != '' else {}
+        return self.client.post(f'{url}?{query}', delta, content_type='application/octet-stream', **headers)
+
+    def test_signature(self):
+        url = reverse('file-signature', kwargs={'pk': self.file.pk})
+        response = self.client.get(url, {'block_size': 1024})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], self.etag)
+        signature = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(signature['size'], len(self.content))
+        self.assertEqual(len(signature['blocks']), 11)
+        last = self.content[10 * 1024:]
+        self.assertEqual(signature['blocks'][-1], [zlib.adler32(last), hashlib.sha256(last).hexdigest()[:32]])
+
+        response = self.client.get(url, {'block_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delta_rebuilds_the_new_content(self):
+        old_blob = self.file.blob
+        new_content = self.content[:3000] + b'inserted' + self.content[3000:]
+        delta = (
+            self.copy(0, 2)
+            + self.data(self.content[2048:3000] + b'inserted' + self.content[3000:3072])
+            + self.copy(3, 8)
+        )
+        new_hash = hashlib.sha256(new_content).hexdigest()
+        response = self.send_delta(delta, sha256=new_hash)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"%s"' % new_hash)
+
+        self.file.refresh_from_db()
+        with self.file.blob.open_content() as content:
+            self.assertEqual(content.read(), new_content)
+        old_blob.refresh_from_db()
+        self.assertEqual((old_blob.ref_count, self.file.blob.ref_count), (0, 1))
+
+        # The old signature no longer applies.
+        self.assertEqual(self.send_delta(delta).status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_invalid_deltas_leave_the_file_unchanged(self):
+        blob_id = self.file.blob_id
+        for delta in (self.copy(10, 2), self.copy(0, 0), b'X', self.data(b'abc')[:-1], self.copy(0, 1)[:5]):
+            self.assertEqual(self.send_delta(delta).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.send_delta(self.copy(0, 11), sha256='0' * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.send_delta(self.copy(0, 11), etag='').status_code, status.HTTP_428_PRECONDITION_REQUIRED)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.blob_id, blob_id)
+
+    def test_delta_requires_edit_permission(self):
+        self.create_share(self.owner, self.other, self.file)
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.send_delta(self.copy(0, 11)).status_code, status.HTTP_403_FORBIDDEN)
+        url = reverse('file-signature', kwargs={'pk': self.file.pk})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), FILE_COMPRESSION='gzip')
+class CompressedDownloadTest(APITestCase, UserMixin, FileMixin, FolderMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = self.create_user('user1', 'password123')
+        self.folder = self.create_folder('Data', self.user)
+        self.content = b''.join(b'%d,row,%d\n' % (index, index * 7) for index in range(2000))
+        self.file = self.create_file('data.csv', self.folder, self.user, content=self.content)
+        self.url = reverse('file-download', kwargs={'pk': self.file.pk})
+        self.client.force_authenticate(user=self.user)
+
+    def test_compressible_content_is_stored_compressed(self):
+        blob = self.file.blob
+        self.assertEqual(blob.encoding, 'gzip')
+        self.assertEqual(blob.size, len(self.content))
+        self.assertLess(blob.file.size, len(self.content) / 2)
+
+        media = self.create_file('photo.jpg', self.folder, self.user, content=self.content[:4096])
+        self.assertEqual(media.blob.encoding, '')
+        noise = self.create_file('noise.txt', self.folder, self.user, content=os.urandom(4096))
+        self.assertEqual(noise.blob.encoding, '')
+
+    def test_clients_accepting_gzip_get_the_stored_form(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(gzip.decompress(body), self.content)
+        self.assertEqual(response['ETag'], '"%s-gzip"' % self.file.content_hash)
+
+        not_modified = self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_other_clients_get_decompressed_content(self):
+        for accept_encoding in ('', 'identity', 'gzip;q=0'):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(int(response['Content-Length']), len(self.content))
+            self.assertEqual(b''.join(response.streaming_content), self.content)
+            self.assertEqual(response['ETag'], '"%s"' % self.file.content_hash)
+
+    def test_ranges_apply_to_decompressed_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-149', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:150])
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD='x-accel-redirect')
+    def test_compressed_content_is_not_offloaded(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_folder_archive_holds_decompressed_content(self):
+        url = reverse('folder-download', kwargs={'pk': self.folder.pk})
+        body = b''.join(self.client.get(url).streaming_content)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read('Data/data.csv'), self.content)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), FILE_PREVIEW_WORKERS=0)
+class FilePreviewTest(APITestCase, UserMixin, FileMixin, FolderMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = self.create_user('owner', 'password123')
+        self.other = self.create_user('other', 'password123')
+        self.folder = self.create_folder('Photos', self.owner)
+        image = io.BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(image, format='PNG')
+        self.photo = self.create_file('photo.png', self.folder, self.owner, content=image.getvalue())
+        self.client.force_authenticate(user=self.owner)
+
+    def preview(self, file, **params):
+        return self.client.get(reverse('file-preview', kwargs={'pk': file.pk}), params)
+
+    def test_preview_fits_the_requested_size(self):
+        response = self.preview(self.photo, size=128)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (128, 96))
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        cached = self.preview(self.photo, size=128)
+        self.assertEqual(cached.content, response.content)
+        not_modified = self.client.get(
+            reverse('file-preview', kwargs={'pk': self.photo.pk}), {'size': 128},
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_no_preview_for_unsupported_content(self):
+        document = self.create_file('notes.txt', self.folder, self.owner)
+        self.assertEqual(self.preview(document).status_code, status.HTTP_404_NOT_FOUND)
+        broken = self.create_file('broken.jpg', self.folder, self.owner, content=b'not an image')
+        self.assertEqual(self.preview(broken).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_size(self):
+        self.assertEqual(self.preview(self.photo, size=100).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_preview_requires_read_permission(self):
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.preview(self.photo).status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(FILE_PREVIEW_WORKERS=1)
+    def test_preview_is_rendered_by_the_worker_pool(self):
+        response = self.preview(self.photo)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        deadline = time.monotonic() + 30
+        while response.status_code == status.HTTP_202_ACCEPTED and time.monotonic() < deadline:
+            time.sleep(0.1)
+            response = self.preview(self.photo)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (256, 192))
+
+    def tearDown(self):
+        caches['previews'].clear()
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class FolderDownloadTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = self.create_user('user1', 'password123')
+        self.user2 = self.create_user('user2', 'password123')
+        self.root = self.create_folder('Root', self.user1)
+        self.child = self.create_folder('Child', self.user1, self.root)
+        self.secret = self.create_folder('Secret', self.user1, self.child)
+        self.create_folder('Empty', self.user1, self.root)
+        self.create_file('a.txt', self.root, self.user1, content=b'a')
+        self.create_file('b.txt', self.child, self.user1, content=b'b')
+        self.create_file('c.txt', self.secret, self.user1, content=b'c')
+        self.url = reverse('folder-download', kwargs={'pk': self.root.pk})
+
+    def download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_download_keeps_hierarchy(self):
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(
+            self.download(),
+            {
+                'Root/': b'',
+                'Root/Child/': b'',
+                'Root/Child/Secret/': b'',
+                'Root/Empty/': b'',
+                'Root/a.txt': b'a',
+                'Root/Child/b.txt': b'b',
+                'Root/Child/Secret/c.txt': b'c',
+            },
+        )
+
+    def test_download_skips_unreadable_content(self):
+        self.create_share(self.user1, self.user2, self.root)
+        self.create_share(self.user1, self.user2, self.secret, can_read=False)
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(
+            sorted(self.download()),
+            ['Root/', 'Root/Child/', 'Root/Child/b.txt', 'Root/Empty/', 'Root/a.txt'],
+        )
+
+    def test_download_requires_read_permission(self):
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class AsgiStreamingTest(APITestCase, UserMixin, FileMixin, FolderMixin):
+
+    def setUp(self):
+        self.user = self.create_user('user1', 'password123')
+        self.token = Token.objects.create(user=self.user)
+        self.folder = self.create_folder('Folder1', self.user)
+        self.content = os.urandom(200 * 1024)
+        self.file = self.create_file('data.bin', self.folder, self.user, content=self.content)
+
+    async def get(self, path, headers=()):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'Token {self.token.key}'.encode()),
+                *headers,
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        # Like the test clients, keep the test transaction open across the request.
+        request_started.disconnect(close_old_connections)
+        try:
+            communicator = ApplicationCommunicator(application, scope)
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            start = await communicator.receive_output(timeout=10)
+            messages = []
+            while True:
+                message = await communicator.receive_output(timeout=10)
+                messages.append(message)
+                if not message.get('more_body'):
+                    break
+        finally:
+            request_started.connect(close_old_connections)
+        return start, messages
+
+    async def test_file_download_is_streamed_in_chunks(self):
+        start, messages = await self.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(start['status'], status.HTTP_200_OK)
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages), self.content)
+        self.assertGreater(len(messages), 2)
+
+    async def test_range_download(self):
+        start, messages = await self.get(
+            f'/api/files/{self.file.pk}/download/', headers=[(b'range', b'bytes=100-199')]
+        )
+        self.assertEqual(start['status'], status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages), self.content[100:200])
+
+    async def test_folder_archive_reads_the_database_while_streaming(self):
+        start, messages = await self.get(f'/api/folders/{self.folder.pk}/download/')
+        self.assertEqual(start['status'], status.HTTP_200_OK)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(message.get('body', b'') for message in messages)))
+        self.assertEqual(archive.read('Folder1/data.bin'), self.content)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class ShareViewSetTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = self.create_user('owner', 'password123')
+        self.users = [self.create_user(f'user{index}', 'password123') for index in range(3)]
+        self.folder = self.create_folder('Folder1', self.owner)
+        self.files = [self.create_file(f'File{index}', self.folder, self.owner) for index in range(3)]
+        self.client.force_authenticate(user=self.owner)
+        self.url = reverse('share-batch-share')
+
+    def batch_data(self, users, **permissions):
+        return {
+            'files': [file.id for file in self.files],
+            'folders': [self.folder.id],
+            'usernames': [user.username for user in users],
+            **permissions,
+        }
+
+    def test_batch_share_creates_and_updates_shares(self):
+        self.create_share(self.owner, self.users[0], self.files[0], can_read=True)
+
+        response = self.client.post(self.url, self.batch_data(self.users, can_edit=True), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Share.objects.count(), 12)
+        self.assertEqual(
+            Share.objects.filter(permissions=Share.READ | Share.EDIT).count(), 12
+        )
+
+    def test_batch_share_query_count_does_not_depend_on_user_count(self):
+        with CaptureQueriesContext(connection) as one_user:
+            self.client.post(self.url, self.batch_data(self.users[:1]), format='json')
+        Share.objects.all().delete()
+        with CaptureQueriesContext(connection) as all_users:
+            self.client.post(self.url, self.batch_data(self.users), format='json')
+        self.assertEqual(len(one_user), len(all_users))
+
+    def test_batch_share_requires_share_permission(self):
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.post(self.url, self.batch_data(self.users[1:]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.create_share(self.owner, self.users[0], self.folder, can_share=True)
+        response = self.client.post(self.url, self.batch_data(self.users[1:]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_batch_share_rejects_unknown_users_and_objects(self):
+        data = self.batch_data(self.users)
+        data['usernames'].append('ghost')
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('usernames', response.data)
+
+        data = self.batch_data(self.users)
+        data['files'].append(0)
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data['denied'], {'files': [0]})
+
+    def test_denied_objects_are_reported_by_id_only(self):
+        stranger = self.create_user('stranger', 'password123')
+        secret = self.create_folder('TopSecretProject', self.owner, parent=self.folder)
+        self.client.force_authenticate(user=stranger)
+        response = self.client.post(
+            self.url,
+            {'files': [], 'folders': [secret.id, 0], 'usernames': [self.users[0].username]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data['denied'], {'folders': [0, secret.id]})
+        self.assertNotIn('TopSecretProject', str(response.data))
+
+    def test_batch_unshare(self):
+        self.client.post(self.url, self.batch_data(self.users), format='json')
+        url = reverse('share-batch-unshare')
+        response = self.client.post(url, self.batch_data(self.users[:2]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(Share.objects.values_list('shared_with', flat=True)), {self.users[2].id})
+
+        response = self.client.post(url, self.batch_data([self.owner]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class SharedWithMeViewTest(APITestCase, UserMixin, FileMixin, FolderMixin, ShareMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = self.create_user('owner', 'password123')
+        self.other_owner = self.create_user('other', 'password123')
+        self.user = self.create_user('user', 'password123')
+        self.folder = self.create_folder('Folder1', self.owner)
+        self.files = [self.create_file(f'File{index}', self.folder, self.owner) for index in range(5)]
+        for file in self.files:
+            self.create_share(self.owner, self.user, file, can_read=True)
+        self.other_file = self.create_file('Other', None, self.other_owner)
+        self.create_share(self.other_owner, self.user, self.other_file, can_read=True, can_edit=True)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('file-shared-with-me')
+
+    def test_pages_follow_the_cursor(self):
+        names = []
+        url = self.url + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            names += [file['name'] for file in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(names), 6)
+        self.assertEqual(set(names), {file.name for file in self.files} | {'Other'})
+
+    def test_listings_load_files_in_bulk(self):
+        # One query for the page, whatever its size.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 6)
+
+        self.client.force_authenticate(user=self.owner)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('file-personal'))
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_filter_by_sharer_and_permission(self):
+        response = self.client.get(self.url, {'shared_by': 'other'})
+        self.assertEqual([file['name'] for file in response.data['results']], ['Other'])
+
+        response = self.client.get(self.url, {'permission': 'edit'})
+        self.assertEqual([file['name'] for file in response.data['results']], ['Other'])
+
+        response = self.client.get(self.url, {'permission': 'owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class PersonalViewTest(APITestCase, UserMixin, FileMixin, FolderMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = self.create_user('user1', 'password123')
+        self.root = self.create_folder('Root', self.user)
+        self.subfolders = [self.create_folder(f'Sub{index}', self.user, self.root) for index in range(3)]
+        self.root_file = self.create_file('RootFile', None, self.user)
+        self.nested_file = self.create_file('Nested', self.root, self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_parent_filter(self):
+        response = self.client.get(reverse('folder-personal'), {'parent': self.root.id})
+        self.assertEqual(
+            {folder['name'] for folder in response.data['results']},
+            {folder.name for folder in self.subfolders},
+        )
+
+        response = self.client.get(reverse('folder-personal'), {'parent': 'root'})
+        self.assertEqual([folder['name'] for folder in response.data['results']], ['Root'])
+
+        response = self.client.get(reverse('file-personal'), {'parent': 'root'})
+        self.assertEqual([file['name'] for file in response.data['results']], ['RootFile'])
+
+        response = self.client.get(reverse('file-personal'), {'parent': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sparse_fieldsets_skip_nested_content(self):
+        url = reverse('folder-personal')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,name'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        self.assertEqual(len(queries), 1)
+
+    def test_pagination(self):
+        response = self.client.get(reverse('folder-personal'), {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class UploadSessionViewSetTest(APITestCase, UserMixin, FolderMixin):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = self.create_user('user1', 'password123')
+        self.folder = self.create_folder('Folder1', self.user)
+        self.client.force_authenticate(user=self.user)
+        self.content = os.urandom(1000)
+
+    def create_session(self, name='big.bin'):
+        response = self.client.post(
+            reverse('upload-list'),
+            {'name': name, 'size': len(self.content), 'folder': self.folder.id},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return reverse('upload-detail', kwargs={'pk': response.data['id']})
+
+    def put_chunk(self, url, start, end):
+        return self.client.put(
+            url,
+            self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}',
+        )
+
+    def test_resumable_upload(self):
+        url = self.create_session()
+        self.assertEqual(self.put_chunk(url, 0, 399).data['offset'], 400)
+
+        # A chunk past the offset is refused with the offset to resume from.
+        response = self.put_chunk(url, 600, 999)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.get(url).data['offset'], 400)
+
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self.put_chunk(url, 300, 999)  # Overlapping retries are accepted
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual((file.name, file.folder), ('big.bin', self.folder))
+        with file.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertEqual(file.content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_direct_upload(self):
+        response = self.client.post(
+            reverse('upload-list'),
+            {
+                'name': 'direct.bin',
+                'size': len(self.content),
+                'folder': self.folder.id,
+                'direct': True,
+                'sha256': hashlib.sha256(self.content).hexdigest(),
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload = response.data['upload']
+        finalize_url = reverse('upload-finalize', kwargs={'pk': response.data['id']})
+
+        # The presigned request needs no API credentials and checks the content.
+        anonymous = APIClient()
+        response = anonymous.put(upload['url'], self.content[:-1], content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(finalize_url).status_code, status.HTTP_409_CONFLICT)
+
+        response = anonymous.put(upload['url'], self.content, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.post(finalize_url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual(file.content_hash, hashlib.sha256(self.content).hexdigest())
+        with file.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+    def test_direct_upload_requires_hash_and_valid_token(self):
+        response = self.client.post(
+            reverse('upload-list'),
+            {'name': 'direct.bin', 'size': 10, 'direct': True},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = APIClient().put(reverse('transfer', args=['forged']), b'data', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_range(self):
+        url = self.create_session()
+        response = self.client.put(url, b'abc', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.put_chunk(url, 0, 1000)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sessions_are_private(self):
+        url = self.create_session()
+        self.client.force_authenticate(user=self.create_user('user2', 'password123'))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_abort_and_cleanup(self):
+        url = self.create_session()
+        self.put_chunk(url, 0, 99)
+        session = UploadSession.objects.get()
+        self.assertTrue(os.path.exists(session.part_path))
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.exists(session.part_path))
+
+        self.create_session()
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        call_command('cleanup_upload_sessions', stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_lost_part_files_rewind_the_session(self):
+        url = self.create_session()
+        self.put_chunk(url, 0, 399)
+        session = UploadSession.objects.get()
+        os.remove(session.part_path)
+
+        response = self.put_chunk(url, 400, 999)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['offset'], 0)
+        self.assertFalse(os.path.exists(session.part_path))
+
+        self.put_chunk(url, 0, 999)
+        os.remove(session.part_path)
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.get(url).data['offset'], 0)
+        self.assertFalse(File.objects.exists())
+
+    def test_declared_hash_is_checked_on_finalize(self):
+        response = self.client.post(
+            reverse('upload-list'),
+            {'name': 'big.bin', 'size': len(self.content), 'sha256': hashlib.sha256(b'other').hexdigest()},
+            format='json',
+        )
+        url = reverse('upload-detail', kwargs={'pk': response.data['id']})
+        self.put_chunk(url, 0, 999)
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_object_storage_only_takes_direct_sessions(self):
+        url = self.create_session()
+        with override_settings(FILE_STORAGE_BUCKET='bucket'):
+            response = self.client.post(
+                reverse('upload-list'), {'name': 'other.bin', 'size': 10}, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('direct', response.data)
+            self.assertEqual(self.put_chunk(url, 0, 99).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sessions_receiving_chunks_survive_cleanup(self):
+        url = self.create_session()
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.put_chunk(url, 0, 99).status_code, status.HTTP_200_OK)
+        call_command('cleanup_upload_sessions', stdout=io.StringIO())
+        self.assertEqual(UploadSession.objects.get().offset, 100)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR + '/media'):
+            shutil.rmtree(TEST_DIR + '/media')
@@ -0,0 +1,7 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def get_transfers():
+    """Return an instance of the transfer backend named by FILE_TRANSFER_BACKEND."""
+    return import_string(settings.FILE_TRANSFER_BACKEND)()
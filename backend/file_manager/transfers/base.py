@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from file_manager.models import Blob
+
+
+class BaseTransfers:
+    """
+    Issues the short-lived URLs through which clients send content to and
+    fetch it from the storage directly, and checks what they uploaded before
+    it becomes a blob.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or default_storage
+        self.max_age = settings.FILE_TRANSFER_URL_MAX_AGE
+
+    def upload_target(self, request, key, size, content_hash):
+        """
+        Return the request a client makes to upload `size` bytes hashing to
+        `content_hash` under `key`, as a dict with "url", "method" and
+        "headers" keys.
+        """
+        raise NotImplementedError("subclasses of BaseTransfers must provide an upload_target() method")
+
+    def download_url(self, request, blob, filename):
+        """Return a URL downloading the content of `blob` as an attachment named `filename`."""
+        raise NotImplementedError("subclasses of BaseTransfers must provide a download_url() method")
+
+    def verify_upload(self, key, size, content_hash):
+        """Whether `key` holds exactly `size` bytes hashing to `content_hash`."""
+        if not self.storage.exists(key) or self.storage.size(key) != size:
+            return False
+        with self.storage.open(key, "rb") as content:
+            return Blob.hash_content(content) == content_hash
+
+    def move(self, key, name):
+        """Move the uploaded object at `key` to `name`, replacing any object already there."""
+        with self.storage.open(key, "rb") as content:
+            self.storage.delete(name)
+            self.storage.save(name, content)
+        self.storage.delete(key)
+
+    def delete(self, key):
+        self.storage.delete(key)
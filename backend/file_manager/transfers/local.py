@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+
+from django.core import signing
+from django.urls import reverse
+
+from .base import BaseTransfers
+
+CHUNK_SIZE = 64 * 1024
+
+SALT = "file_manager.transfers"
+
+
+class LocalTransfers(BaseTransfers):
+    """
+    Transfers against the file system storage. The URLs point at this app's
+    transfer endpoint with a signed, expiring token, standing in for the
+    presigned URLs of an object store.
+    """
+
+    def sign(self, request, **payload):
+        token = signing.dumps(payload, salt=SALT)
+        return request.build_absolute_uri(reverse("transfer", args=[token]))
+
+    def unsign(self, token):
+        """Return the payload of `token`; raises signing.BadSignature when it is forged or expired."""
+        return signing.loads(token, salt=SALT, max_age=self.max_age)
+
+    def upload_target(self, request, key, size, content_hash):
+        url = self.sign(request, op="upload", key=key, size=size, hash=content_hash)
+        return {
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": "application/octet-stream"},
+        }
+
+    def download_url(self, request, blob, filename):
+        return self.sign(request, op="download", hash=blob.hash, filename=filename)
+
+    def receive(self, key, stream, size, content_hash):
+        """
+        Write the body of an upload request to `key`, refusing it with a
+        ValueError unless it is exactly `size` bytes hashing to `content_hash`.
+        """
+        path = self.storage.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        received = 0
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as part:
+            try:
+                while received <= size:
+                    block = stream.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    received += len(block)
+                    digest.update(block)
+                    part.write(block)
+                if received != size or digest.hexdigest() != content_hash:
+                    raise ValueError("The content does not match the declared size and hash.")
+            except BaseException:
+                os.remove(part.name)
+                raise
+        os.replace(part.name, path)
+
+    def move(self, key, name):
+        destination = self.storage.path(name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(self.storage.path(key), destination)
@@ -0,0 +1,264 @@
+import os
+import re
+
+from django.core.exceptions import ValidationError
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.db.models import Q
+
+from .blobs import store_blob, store_blobs, store_uploaded_blob
+from .models import Blob, File, Folder, StorageUsage
+
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def parse_content_range(header):
+    """Parse a `Content-Range: bytes <start>-<end>/<total>` header into integers."""
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise ValueError("Expected a 'Content-Range: bytes <start>-<end>/<total>' header.")
+    start, end, total = (int(value) for value in match.groups())
+    if end < start:
+        raise ValueError("The end of the range must not precede its start.")
+    return start, end, total
+
+
+class PartFileMismatch(Exception):
+    """The part file of a session does not hold the bytes its offset claims."""
+
+    def __init__(self, size):
+        super().__init__(f"The stored part of the upload holds {size} bytes.")
+        self.size = size
+
+
+def part_size(session):
+    try:
+        return os.path.getsize(session.part_path)
+    except FileNotFoundError:
+        return 0
+
+
+def write_chunk(session, stream, start, length):
+    """
+    Copy `length` bytes of `stream` into the part file of `session` at offset
+    `start`, a block at a time, and return the number of bytes written.
+    Raises PartFileMismatch, writing nothing, when the part file is missing
+    or does not end at the offset of the session, as when it was lost or the
+    chunk reached another host; the bytes before `start` would be garbage.
+    """
+    size = part_size(session)
+    if size != session.offset:
+        raise PartFileMismatch(size)
+    os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+    mode = "r+b" if size else "wb"
+    remaining = length
+    with open(session.part_path, mode) as part:
+        part.seek(start)
+        while remaining:
+            block = stream.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                break
+            part.write(block)
+            remaining -= len(block)
+    return length - remaining
+
+
+class PartFile(DjangoFile):
+    """
+    The part file of an upload session. Exposing `temporary_file_path` lets
+    the file system storage move it into place instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.name
+
+
+def finalize_session(session):
+    """
+    Turn a complete upload session into a File pointing at the blob of its
+    content; the part file becomes that blob unless it is already stored.
+    Raises PartFileMismatch when the part file is not complete, and
+    ValidationError when its content does not match the SHA-256 the client
+    declared, if any.
+    """
+    file = File(name=session.name, folder=session.folder, owner=session.owner)
+    # Fail before the part file is consumed, so the session can be retried.
+    file.check_model_has_unique_name()
+    StorageUsage.check_quota(session.owner_id, session.size)
+    size = part_size(session)
+    if size != session.size:
+        raise PartFileMismatch(size)
+
+    with PartFile(open(session.part_path, "rb")) as part:
+        content_hash = Blob.hash_content(part)
+        if session.sha256 and content_hash != session.sha256:
+            raise ValidationError("The uploaded content does not match the declared SHA-256.")
+        file.blob = store_blob(part, content_hash, filename=session.name)
+
+    with transaction.atomic():
+        file.save()
+        session.delete()
+    return file
+
+
+def finalize_direct_session(session, transfers):
+    """
+    Turn a direct upload session into a File once `transfers` confirms the
+    staged object has the declared size and hash; returns None otherwise.
+    """
+    file = File(name=session.name, folder=session.folder, owner=session.owner)
+    file.check_model_has_unique_name()
+    StorageUsage.check_quota(session.owner_id, session.size)
+    if not transfers.verify_upload(session.staging_key, session.size, session.sha256):
+        return None
+
+    file.blob = store_uploaded_blob(
+        transfers, session.staging_key, session.sha256, session.size
+    )
+    with transaction.atomic():
+        file.save()
+        session.delete()
+    return file
+
+
+def split_upload_path(path):
+    """
+    Split the relative path of a batch upload into its directory names and
+    file name; raises ValueError for paths that could escape the destination.
+    """
+    parts = path.replace("\\", "/").split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"'{path}' is not a valid relative path.")
+    if any(len(part) > 128 for part in parts):
+        raise ValueError(f"'{path}' has a name longer than 128 characters.")
+    return tuple(parts[:-1]), parts[-1]
+
+
+def _within(field, folders):
+    """Match rows whose `field` is one of `folders`, where None stands for the root level."""
+    query = Q(**{f"{field}__in": [folder for folder in folders if folder is not None]})
+    if None in folders:
+        query |= Q(**{f"{field}__isnull": True})
+    return query
+
+
+def _folder_id(folder):
+    return folder.id if folder is not None else None
+
+
+def _folder_path(folder):
+    return folder.path if folder is not None else Folder.PATH_SEPARATOR
+
+
+def _resolve_folders(owner, destination, directories):
+    """
+    Map every directory tuple of `directories`, relative to `destination`,
+    to the folder of `owner` at that place, creating the missing ones. Each
+    level of the tree costs one query, plus three when folders are created:
+    the bulk insert, reading the new ids back (not every backend returns
+    them) and setting their paths. Raises ValidationError when a new folder
+    would be nested too deeply for its path to be stored.
+    """
+    folders = {(): destination}
+    prefixes = {directory[:depth] for directory in directories for depth in range(1, len(directory) + 1)}
+    for depth in range(1, max(map(len, prefixes), default=0) + 1):
+        level = [prefix for prefix in prefixes if len(prefix) == depth]
+        parents = {folders[prefix[:-1]] for prefix in level}
+        existing = {
+            (folder.parent_id, folder.name): folder
+            for folder in Folder.objects.filter(
+                _within("parent", parents), owner=owner, name__in={prefix[-1] for prefix in level}
+            )
+        }
+
+        missing = []
+        for prefix in level:
+            parent = folders[prefix[:-1]]
+            folder = existing.get((_folder_id(parent), prefix[-1]))
+            if folder is None:
+                missing.append(prefix)
+                folder = Folder(name=prefix[-1], owner=owner, parent=parent)
+            folders[prefix] = folder
+        if not missing:
+            continue
+        too_deep = [
+            "/".join(prefix)
+            for prefix in missing
+            if not Folder.path_fits(len(_folder_path(folders[prefix[:-1]])) + Folder.PATH_ID_LENGTH + 1)
+        ]
+        if too_deep:
+            raise ValidationError([f"The folder '{path}' would be nested too deeply." for path in too_deep])
+
+        Folder.objects.bulk_create([folders[prefix] for prefix in missing])
+        # Rows inserted in bulk have no path yet, which tells them apart.
+        created = {
+            (folder.parent_id, folder.name): folder
+            for folder in Folder.objects.filter(_within("parent", parents), owner=owner, path="")
+        }
+        for prefix in missing:
+            parent = folders[prefix[:-1]]
+            folder = created[(_folder_id(parent), prefix[-1])]
+            folder.path = f"{_folder_path(parent)}{folder.id}/"
+            folders[prefix] = folder
+        Folder.objects.bulk_update([folders[prefix] for prefix in missing], ["path"])
+    return folders
+
+
+def upload_batch(owner, destination, entries):
+    """
+    Create a File for each (directories, name, content) entry of `entries`,
+    placed under `destination` (None for the root level) and creating the
+    directories as folders. The number of queries depends on the depth of
+    the tree, not on the number of files. Raises ValidationError, keeping
+    nothing, when a name is taken or given twice, and QuotaExceeded when
+    the files do not fit the quota of `owner`.
+    """
+    with transaction.atomic():
+        folders = _resolve_folders(owner, destination, {directory for directory, _, _ in entries})
+        targets = [(folders[directory], name) for directory, name, _ in entries]
+        places = {folder for folder, _ in targets}
+        names = {name for _, name in targets}
+
+        taken = set(
+            File.objects.filter(_within("folder", places), owner=owner, name__in=names).values_list(
+                "folder_id", "name"
+            )
+        )
+        errors = []
+        for (directory, name, _), (folder, _) in zip(entries, targets):
+            key = (_folder_id(folder), name)
+            if key in taken:
+                path = "/".join(directory + (name,))
+                errors.append(f"A file named '{path}' already exists in the same location for this user.")
+            taken.add(key)
+        if errors:
+            raise ValidationError(errors)
+
+        # Charged before any content is stored; rolled back with the rest.
+        StorageUsage.charge(owner.id, sum(content.size for _, _, content in entries))
+        blobs = store_blobs(
+            [content for _, _, content in entries], [name for _, name, _ in entries]
+        )
+        File.objects.bulk_create(
+            [
+                File(name=name, folder=folder, owner=owner, blob=blob, size=blob.size)
+                for (folder, name), blob in zip(targets, blobs)
+            ]
+        )
+        counts, sizes = {}, {}
+        for (folder, _), blob in zip(targets, blobs):
+            counts[blob.id] = counts.get(blob.id, 0) + 1
+            for pk in folder.path_ids if folder is not None else ():
+                sizes[pk] = sizes.get(pk, 0) + blob.size
+        Blob.add_references(counts)
+        Folder.add_sizes(sizes)
+
+        created = {
+            (file.folder_id, file.name): file
+            for file in File.objects.filter(
+                _within("folder", places), owner=owner, name__in=names
+            ).select_related("blob")
+        }
+    return [created[(_folder_id(folder), name)] for folder, name in targets]
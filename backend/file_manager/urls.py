@@ -6,7 +6,11 @@ from . import views
 router = DefaultRouter()
 router.register(r"files", views.FileViewSet, basename="file")
 router.register(r"folders", views.FolderViewSet, basename="folder")
+router.register(r"shares", views.ShareViewSet, basename="share")
+router.register(r"uploads", views.UploadSessionViewSet, basename="upload")
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("usage/", views.StorageUsageView.as_view(), name="usage"),
+    path("transfers/<str:token>/", views.TransferView.as_view(), name="transfer"),
 ]
@@ -1,17 +1,34 @@
-from django.contrib.contenttypes.models import ContentType
+import io
+
+from core.db.routers import read_from_replica
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils import timezone
 from drf_spectacular.utils import extend_schema
-from rest_framework import mixins, viewsets
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from file_manager.mixins.views import (
     CustomCreateModelMixin,
+    FileDeltaMixin,
     FileDownloadMixin,
+    FilePreviewMixin,
+    FolderDownloadMixin,
     PersonalMixin,
     SharedWithMeMixin,
     ShareModelMixin,
     UnshareModelMixin,
 )
 
-from .models import File, Folder, Share
+from .access import AccessMap
+from .downloads import file_response
+from .models import Blob, File, Folder, QuotaExceeded, Share, StorageUsage, UploadSession
+from .pagination import DriveCursorPagination
 from .permissions import (
     CanDelete,
     CanEdit,
@@ -21,10 +38,26 @@ from .permissions import (
     IsOwner,
 )
 from .serializers import (
+    BatchShareSerializer,
+    BatchUnshareSerializer,
+    BatchUploadSerializer,
     FileSerializer,
     FolderSerializer,
     ShareSerializer,
+    StorageUsageSerializer,
     UnshareSerializer,
+    UploadSessionSerializer,
+)
+from .sharing import share_objects, unshare_objects
+from .transfers import get_transfers
+from .transfers.local import LocalTransfers
+from .uploads import (
+    PartFileMismatch,
+    finalize_direct_session,
+    finalize_session,
+    parse_content_range,
+    upload_batch,
+    write_chunk,
 )
 
 
@@ -40,9 +73,14 @@ class BaseViewSet(
     PersonalMixin,
 ):
     model = None
+    pagination_class = DriveCursorPagination
+    read_actions = ["retrieve", "personal", "shared_with_me"]
     action_to_permission = {
         "retrieve": [IsOwner | CanRead],
         "download": [IsOwner | CanRead],
+        "preview": [IsOwner | CanRead],
+        "signature": [IsOwner | CanRead],
+        "delta": [IsOwner | CanEdit],
         "personal": [IsOwner | CanRead],
         "shared_with_me": [IsOwner | CanRead],
         "update": [IsOwner | CanEdit],
@@ -53,6 +91,11 @@ class BaseViewSet(
         "create": [CanEditParentFolder],
     }
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.read_actions:
+            read_from_replica(request.user)
+
     def get_serializer_class(self):
         if self.action == "share":
             return ShareSerializer
@@ -67,27 +110,34 @@ class BaseViewSet(
         return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        if self.action in ["personal", "get_personal_models"]:
-            return self.model.objects.filter(owner=self.request.user)
-        if self.action == "shared_with_me":
-            content_type = ContentType.objects.get_for_model(self.model)
-            shared_ids = Share.objects.filter(
-                shared_with=self.request.user, content_type=content_type, can_read=True
-            ).values_list("object_id", flat=True)
-            return self.model.objects.filter(id__in=shared_ids)
-        return super().get_queryset()
-
-
-class FolderViewSet(BaseViewSet):
+        if self.action == "personal":
+            queryset = self.get_personal_queryset()
+        elif self.action == "shared_with_me":
+            queryset = self.get_shared_with_me_queryset()
+        else:
+            queryset = super().get_queryset()
+
+        serializer_class = self.get_serializer_class()
+        if self.action in self.read_actions and hasattr(
+            serializer_class, "setup_eager_loading"
+        ):
+            queryset = serializer_class.setup_eager_loading(
+                queryset, self.get_serializer_context()
+            )
+        return queryset
+
+
+class FolderViewSet(BaseViewSet, FolderDownloadMixin):
     queryset = Folder.objects.all()
     serializer_class = FolderSerializer
     model = Folder
 
 
-class FileViewSet(BaseViewSet, FileDownloadMixin):
-    queryset = File.objects.all()
+class FileViewSet(BaseViewSet, FileDownloadMixin, FilePreviewMixin, FileDeltaMixin):
+    queryset = File.objects.select_related("folder", "blob")
     serializer_class = FileSerializer
     model = File
+    parent_field = "folder"
 
     @extend_schema(
         operation_id="upload_file",
@@ -103,3 +153,300 @@ class FileViewSet(BaseViewSet, FileDownloadMixin):
     )
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
+
+    @extend_schema(
+        operation_id="upload_files",
+        request={
+            "multipart/form-data": {
+                "type": "object",
+                "properties": {
+                    "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                    "paths": {"type": "array", "items": {"type": "string"}},
+                    "folder": {"type": "integer", "format": "int64"},
+                },
+                "required": ["files"],
+            }
+        },
+        responses={201: FileSerializer(many=True)},
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="batch",
+        serializer_class=BatchUploadSerializer,
+        pagination_class=None,
+    )
+    def batch(self, request):
+        """
+        Upload many files at once. Each file may come with a relative path in
+        `paths`; its missing folders are created under `folder`.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            files = upload_batch(data["owner"], data["folder"], data["entries"])
+        except ValidationError as error:
+            return Response({"files": error.messages}, status=status.HTTP_400_BAD_REQUEST)
+        except QuotaExceeded as error:
+            return Response({"detail": str(error)}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        return Response(
+            FileSerializer(files, many=True, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ShareViewSet(viewsets.GenericViewSet):
+    """Share or unshare many files and folders with many users in one request."""
+
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        if self.action == "batch_unshare":
+            return BatchUnshareSerializer
+        return BatchShareSerializer
+
+    def _get_targets(self, validated_data):
+        """
+        Load the requested objects and check the user may share every one of
+        them. Missing objects and objects the user may not share get the same
+        answer, which only echoes the ids sent, so nothing is revealed about
+        the objects of others.
+        """
+        files = list(File.objects.select_related("folder").filter(pk__in=validated_data["files"]))
+        folders = list(Folder.objects.filter(pk__in=validated_data["folders"]))
+        access_map = AccessMap.for_request(self.request)
+        denied = {}
+        for key, objects in (("files", files), ("folders", folders)):
+            allowed = {
+                obj.id
+                for obj in objects
+                if obj.owner_id == self.request.user.id
+                or access_map.has_permission(obj, "can_share")
+            }
+            ids = sorted(set(validated_data[key]) - allowed)
+            if ids:
+                denied[key] = ids
+        if denied:
+            return None, Response(
+                {"detail": CanShare.message, "denied": denied},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return files + folders, None
+
+    @action(detail=False, methods=["post"], url_path="batch")
+    def batch_share(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = serializer.validated_data["users"]
+        if request.user in users:
+            return Response(
+                {"error": "Cannot share with yourself"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        objects, error = self._get_targets(serializer.validated_data)
+        if error:
+            return error
+
+        share_objects(
+            objects,
+            users,
+            request.user,
+            Share.build_permissions(**serializer.validated_data),
+        )
+        return Response(
+            {
+                "status": "Sharing process completed",
+                "shared": len(objects),
+                "shared_with": [user.username for user in users],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["post"], url_path="batch-unshare")
+    def batch_unshare(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = serializer.validated_data["users"]
+
+        objects, error = self._get_targets(serializer.validated_data)
+        if error:
+            return error
+        user_ids = {user.id for user in users}
+        if any(obj.owner_id in user_ids for obj in objects):
+            return Response(
+                {"error": "Cannot unshare with the owner"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        unshare_objects(objects, users, request.user)
+        return Response(
+            {
+                "status": "Unsharing process completed",
+                "unshared": len(objects),
+                "unshared_from": [user.username for user in users],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class UploadSessionViewSet(
+    viewsets.GenericViewSet,
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+):
+    """
+    Resumable chunked uploads: create a session, PUT chunks with a
+    Content-Range header, GET it to know where to resume and finalize it into
+    a File. Deleting a session aborts the upload.
+
+    Direct sessions skip the chunks: the client sends the content to the
+    storage with the presigned `upload` request of the session (GET it again
+    for a fresh one), then finalizes it. They are the only kind accepted when
+    FILE_STORAGE_BUCKET is set, since part files are local to one host.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    @extend_schema(
+        operation_id="upload_chunk",
+        request={"application/octet-stream": {"type": "string", "format": "binary"}},
+    )
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.direct:
+            return Response(
+                {"detail": "Direct uploads are sent with their presigned upload request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if settings.FILE_STORAGE_BUCKET:
+            return Response(
+                {"detail": "Chunked uploads are not available with object storage; create a direct session."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            start, end, total = parse_content_range(request.headers.get("Content-Range"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if total != session.size or end >= session.size:
+            return Response(
+                {"detail": f"The range must fit in the {session.size} bytes of the upload."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if start > session.offset:
+            # Chunks must be contiguous: tell the client where to resume from.
+            return Response(
+                {"detail": "Chunk does not start at the upload offset.", "offset": session.offset},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        stream = request.stream or io.BytesIO()
+        try:
+            written = write_chunk(session, stream, start, end - start + 1)
+        except PartFileMismatch as e:
+            return self.resume_from(session, e.size)
+        new_offset = max(session.offset, start + written)
+        # update() skips auto_now; the cleanup command relies on updated_at.
+        now = timezone.now()
+        UploadSession.objects.filter(pk=session.pk).update(offset=new_offset, updated_at=now)
+        session.offset, session.updated_at = new_offset, now
+        return Response(self.get_serializer(session).data)
+
+    def resume_from(self, session, size):
+        """Rewind `session` to the `size` bytes its part file really holds and ask the client to resume there."""
+        UploadSession.objects.filter(pk=session.pk).update(offset=size, updated_at=timezone.now())
+        return Response(
+            {"detail": "The stored part of the upload does not match its offset.", "offset": size},
+            status=status.HTTP_409_CONFLICT,
+        )
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        if not session.direct and session.offset < session.size:
+            return Response(
+                {"detail": "The upload is not complete.", "offset": session.offset},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            if session.direct:
+                file = finalize_direct_session(session, get_transfers())
+            else:
+                file = finalize_session(session)
+        except ValidationError as e:
+            return Response({"detail": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        except QuotaExceeded as e:
+            return Response({"detail": str(e)}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        except PartFileMismatch as e:
+            return self.resume_from(session, e.size)
+        if file is None:
+            return Response(
+                {"detail": "The uploaded content is missing or does not match its size and hash."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(
+            FileSerializer(file, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class TransferView(APIView):
+    """
+    The local stand-in for presigned object store URLs: the signed token
+    issued by LocalTransfers is the only credential, so it works without the
+    API authentication, until it expires.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get_payload(self, token, op):
+        try:
+            payload = self.transfers.unsign(token)
+        except signing.BadSignature:
+            payload = None
+        if not payload or payload.get("op") != op:
+            raise Http404("Unknown or expired transfer.")
+        return payload
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.transfers = LocalTransfers()
+
+    @extend_schema(exclude=True)
+    def get(self, request, token):
+        payload = self.get_payload(token, "download")
+        try:
+            blob = Blob.objects.get(hash=payload["hash"])
+        except Blob.DoesNotExist:
+            raise Http404("File does not exist on the server")
+        return file_response(request, blob, payload["filename"])
+
+    @extend_schema(exclude=True)
+    def put(self, request, token):
+        payload = self.get_payload(token, "upload")
+        try:
+            self.transfers.receive(
+                payload["key"], request.stream or io.BytesIO(), payload["size"], payload["hash"]
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class StorageUsageView(APIView):
+    """The storage used by the current user and their quota."""
+
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses=StorageUsageSerializer)
+    def get(self, request):
+        usage = StorageUsage.objects.filter(pk=request.user.pk).first()
+        return Response(StorageUsageSerializer(usage or StorageUsage(user=request.user)).data)
@@ -126,6 +126,51 @@ task_policy_attachment = aws.iam.RolePolicyAttachment(
     policy_arn=aws.iam.ManagedPolicy.AMAZON_ECS_FULL_ACCESS,
 )
 
+# Creating a bucket holding the content of uploaded files, shared by every
+# Django task
+app_files_bucket = aws.s3.BucketV2("app-files-bucket")
+
+# Clients upload and download file content directly with presigned URLs, so
+# the bucket has to accept cross-origin requests
+app_files_bucket_cors = aws.s3.BucketCorsConfigurationV2(
+    "app-files-bucket-cors",
+    bucket=app_files_bucket.id,
+    cors_rules=[
+        aws.s3.BucketCorsConfigurationV2CorsRuleArgs(
+            allowed_methods=["GET", "PUT"],
+            allowed_origins=["*"],
+            allowed_headers=["*"],
+            expose_headers=["ETag"],
+            max_age_seconds=3600,
+        )
+    ],
+)
+
+# Letting the Django tasks read and write the file content
+files_bucket_policy = aws.iam.RolePolicy(
+    "app-files-bucket-policy",
+    role=app_task_role.id,
+    policy=app_files_bucket.arn.apply(
+        lambda arn: json.dumps(
+            {
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "s3:GetObject",
+                            "s3:PutObject",
+                            "s3:DeleteObject",
+                            "s3:ListBucket",
+                        ],
+                        "Resource": [arn, f"{arn}/*"],
+                    }
+                ],
+            }
+        )
+    ),
+)
+
 # Creating storage space to upload a docker image of our app to
 app_ecr_repo = aws.ecr.Repository("app-ecr-repo", image_tag_mutability="MUTABLE")
 
@@ -381,6 +426,9 @@ django_site_task_definition = aws.ecs.TaskDefinition(
                         "name": "DATABASE_PORT",
                         "value": mysql_rds_server.port.apply(lambda x: str(int(x))),
                     },
+                    {"name": "FILE_STORAGE_BUCKET", "value": app_files_bucket.bucket},
+                    {"name": "AWS_REGION", "value": availability_zone},
+                    {"name": "FILE_DOWNLOAD_OFFLOAD", "value": "redirect"},
                 ],
                 "logConfiguration": {
                     "logDriver": "awslogs",